@@ -0,0 +1,47 @@
+import logging
+import os
+import signal
+
+from placedump.archive import LAST_KEY, SegmentWriter
+from placedump.common import get_redis
+from placedump.constants import socket_key
+
+log = logging.getLogger(__name__)
+running = True
+
+READ_COUNT = int(os.environ.get("ARCHIVE_BATCH_SIZE", "10000"))
+
+
+def stop(signum, frame):
+    global running
+    log.info("caught signal %s, finishing segment", signum)
+    running = False
+
+
+def main():
+    redis = get_redis(decode_responses=False)
+    last_id = redis.get(LAST_KEY) or b"$"
+    log.info("archiving %s from %s", socket_key, last_id)
+
+    def checkpoint(segment_last_id: bytes):
+        redis.set(LAST_KEY, segment_last_id)
+
+    writer = SegmentWriter(checkpoint)
+    writer.start()
+
+    while running:
+        results = redis.xread({socket_key: last_id}, count=READ_COUNT, block=1000)
+        if not results:
+            continue
+
+        messages = results[0][1]
+        last_id = messages[-1][0]
+        writer.write(messages)
+
+    writer.close()
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    main()
@@ -1,9 +1,10 @@
 import asyncio
 import json
 import logging
+import os
 
 import backoff
-from redis import asyncio as aioredis
+from gql.client import AsyncClientSession
 
 from placedump.common import (
     ctx_aioredis,
@@ -12,11 +13,21 @@ from placedump.common import (
     handle_backoff,
 )
 from placedump.constants import config_gql, socket_key, sub_gql
-from placedump.tasks.parse import parse_message
+from placedump.frames import RAW_FRAME_KEY
+from placedump.ingest import FanoutBuffer, stream_payload
+from placedump.tasks.parse import get_highest_index
 
 log = logging.getLogger(__name__)
 tasks = []
-parsers = {}
+fanout = FanoutBuffer(socket_key)
+
+# Every subscription is multiplexed over a small fixed pool of sockets.
+SOCKET_COUNT = int(os.environ.get("DUMP_SOCKETS", "1"))
+channels = [set() for _ in range(SOCKET_COUNT)]
+wakeups = [asyncio.Event() for _ in range(SOCKET_COUNT)]
+
+# Store websocket frames untouched instead of re-encoding decoded results.
+RAW_FRAMES = os.environ.get("DUMP_RAW_FRAMES", "0") == "1"
 
 
 async def get_meta() -> dict:
@@ -25,47 +36,45 @@ async def get_meta() -> dict:
         return result or {}
 
 
-async def push_to_key(redis: aioredis.Redis, key: str, payload: dict, canvas_id: int):
-    await redis.xadd(key, payload, maxlen=2000000)
+async def push_to_key(payload: dict, canvas_id: int):
+    await fanout.put(payload, canvas_id)
 
-    message = payload["message"]
-    await redis.publish(key, message)
-    parse_message.delay(message, canvas_id)
 
+def get_payload(result: dict, canvas_id) -> dict:
+    if RAW_FRAMES:
+        return stream_payload(result[RAW_FRAME_KEY], canvas_id, raw=True)
 
-async def main():
-    tasks.append(asyncio.create_task(graphql_parser("config")))
-    tasks.append(asyncio.create_task(parser_launcher()))
+    # append canvas id to messages
+    result["canvas_id"] = canvas_id
 
-    await asyncio.gather(*tasks)
+    return stream_payload(json.dumps(result), canvas_id, raw=False)
 
 
-async def parser_launcher():
-    while True:
-        meta = await get_meta()
-        highest_board = int(meta.get("index", "0"))
+def add_channel(canvas_id):
+    index = 0 if canvas_id == "config" else canvas_id % SOCKET_COUNT
 
-        if len(parsers) < highest_board + 1:
-            log.info("meta canvas count update, new meta is")
-            log.info(meta)
+    if canvas_id not in channels[index]:
+        log.info("adding canvas %s to socket %s", canvas_id, index)
+        channels[index].add(canvas_id)
+        wakeups[index].set()
 
-            for x in range(0, highest_board + 1):
-                if x not in parsers:
-                    task = asyncio.create_task(graphql_parser(x))
-                    parsers[x] = task
-                    tasks.append(task)
 
-        await asyncio.sleep(1)
+async def main():
+    tasks.append(asyncio.create_task(fanout.run()))
 
+    # Start with the last known canvas count, the config channel adds the rest.
+    meta = await get_meta()
+    add_channel("config")
+    for x in range(0, int(meta.get("index", "0")) + 1):
+        add_channel(x)
 
-@backoff.on_exception(
-    backoff.fibo,
-    Exception,
-    max_time=30,
-    on_backoff=handle_backoff,
-    on_giveup=handle_backoff,
-)
-async def graphql_parser(canvas_id):
+    for index in range(0, SOCKET_COUNT):
+        tasks.append(asyncio.create_task(socket_worker(index)))
+
+    await asyncio.gather(*tasks)
+
+
+def get_subscription(canvas_id):
     # pick the corrent gql schema and pick variables for canvas / config grabs.
     if canvas_id == "config":
         schema = config_gql
@@ -89,26 +98,66 @@ async def graphql_parser(canvas_id):
             }
         }
 
+    return schema, variables
+
+
+@backoff.on_exception(
+    backoff.fibo,
+    Exception,
+    max_time=30,
+    on_backoff=handle_backoff,
+    on_giveup=handle_backoff,
+)
+async def socket_worker(index: int):
     # Using `async with` on the client will start a connection on the transport
     # and provide a `session` variable to execute queries on this connection
-    log.info("socket connecting for canvas %s", canvas_id)
-
-    async with ctx_aioredis() as redis:
-        async with get_async_gql_client() as session:
-            log.info("socket connected for canvas %s", canvas_id)
-            async for result in session.subscribe(schema, variable_values=variables):
-                # append canvas id to messages
-                result["canvas_id"] = canvas_id
-
-                await push_to_key(
-                    redis,
-                    socket_key,
-                    {
-                        "message": json.dumps(result),
-                        "type": "text",
-                    },
-                    canvas_id=canvas_id,
+    log.info("socket %s connecting", index)
+
+    async with get_async_gql_client(raw=RAW_FRAMES) as session:
+        log.info("socket %s connected", index)
+        subscriptions = {}
+
+        try:
+            while True:
+                # Subscribe to anything assigned to this socket since the last pass.
+                for canvas_id in channels[index]:
+                    if canvas_id not in subscriptions:
+                        subscriptions[canvas_id] = asyncio.create_task(
+                            graphql_parser(session, canvas_id)
+                        )
+
+                wakeups[index].clear()
+                waiter = asyncio.create_task(wakeups[index].wait())
+                done, _ = await asyncio.wait(
+                    [waiter, *subscriptions.values()],
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
+                waiter.cancel()
+
+                for canvas_id, task in list(subscriptions.items()):
+                    if task in done:
+                        # Errors reconnect the socket, completions resubscribe.
+                        del subscriptions[canvas_id]
+                        task.result()
+        finally:
+            for task in subscriptions.values():
+                task.cancel()
+
+
+async def graphql_parser(session: AsyncClientSession, canvas_id):
+    schema, variables = get_subscription(canvas_id)
+    log.info("subscribing to canvas %s", canvas_id)
+
+    async for result in session.subscribe(schema, variable_values=variables):
+        # subscribe to new canvases as soon as the config announces them
+        if canvas_id == "config":
+            config = json.loads(result[RAW_FRAME_KEY]) if RAW_FRAMES else result
+            highest_index = get_highest_index(config)
+            if highest_index is not None:
+                for x in range(0, highest_index + 1):
+                    add_channel(x)
+
+        await push_to_key(get_payload(result, canvas_id), canvas_id=canvas_id)
 
 
 if __name__ == "__main__":
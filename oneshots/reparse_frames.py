@@ -0,0 +1,47 @@
+"""Re-queue the pixels of a list of frame URLs.
+
+Frames are read through the node's frame cache, so re-runs on the same node
+only hit B2 for frames that were evicted. Decoding is spread over every core
+with a DecodePool.
+"""
+
+import sys
+
+import numpy as np
+
+from placedump import pixelqueue
+from placedump.common import get_redis
+from placedump.decodepool import DecodePool
+from placedump.framediff import parse_frame_url
+from placedump.palette import TRANSPARENT
+
+# Same cap as get_non_transparent, full frames go through diff_full_frame.
+MAX_PIXELS = 8192
+
+
+def main():
+    with open(sys.argv[1] if len(sys.argv) > 1 else "urls", "r") as f:
+        urls = [line.strip() for line in f if line.strip()]
+        urls = [url for url in urls if parse_frame_url(url)]
+
+    redis = get_redis()
+
+    with DecodePool() as pool:
+        for url, handle in zip(urls, pool.imap(urls)):
+            if handle.error:
+                continue
+
+            with handle:
+                ys, xs = np.nonzero(handle.array != TRANSPARENT)
+
+            if len(xs) <= MAX_PIXELS:
+                board = parse_frame_url(url)[1]
+                pixelqueue.push(redis, [(board, x, y) for x, y in zip(xs, ys)])
+
+            sys.stdout.write(".")
+            sys.stdout.flush()
+
+
+# DecodePool workers are spawned and import this file again.
+if __name__ == "__main__":
+    main()
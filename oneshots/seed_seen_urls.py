@@ -0,0 +1,18 @@
+from placedump.model import get_cass
+from placedump.urls import mark_seen
+
+batch = []
+i = 0
+
+for row in get_cass().execute("SELECT url FROM urls"):
+    batch.append(row.url)
+    i += 1
+
+    if len(batch) >= 10000:
+        mark_seen(batch)
+        batch.clear()
+        print("seeded", i)
+
+if batch:
+    mark_seen(batch)
+print("seeded", i)
@@ -4,22 +4,14 @@ from concurrent.futures import ThreadPoolExecutor
 import ujson as json
 from placedump.common import get_redis
 from placedump.constants import socket_key
-from placedump.model import URL, sm
 from placedump.tasks.pixels import download_url
-from sqlalchemy import func, select
+from placedump.urls import filter_unseen
 
-db = sm()
 redis = get_redis()
-sql_url = set()
-to_backfill = set()
+to_backfill = {}
 last_id = "0"
 pool = ThreadPoolExecutor(max_workers=8)
 
-for url in db.execute(select(URL)).scalars():
-    sql_url.add(url.url)
-
-print(len(sql_url), "in database")
-
 while True:
     results = redis.xread({socket_key: last_id}, count=10000)
     if not results:
@@ -54,16 +46,17 @@ while True:
             except KeyError:
                 continue
 
-        if url not in sql_url:
-            to_backfill.add((canvas_id, url))
-
-print(len(to_backfill), "to backfill")
+        to_backfill[url] = canvas_id
 
+print(len(to_backfill), "urls in stream")
 
-for item in to_backfill:
-    download_url.apply_async(
-        args=(item[0], item[1]),
-        priority=10,
-    )
-    sys.stdout.write(".")
-    sys.stdout.flush()
+# Drop anything already fetched before it hits Celery.
+candidates = list(to_backfill)
+for offset in range(0, len(candidates), 1000):
+    for url in filter_unseen(candidates[offset : offset + 1000]):
+        download_url.apply_async(
+            args=(to_backfill[url], url),
+            priority=10,
+        )
+        sys.stdout.write(".")
+        sys.stdout.flush()
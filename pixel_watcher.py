@@ -1,6 +1,5 @@
 import asyncio
 import functools
-import json
 import logging
 from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
@@ -9,6 +8,7 @@ import backoff
 from gql import gql
 from gql.dsl import DSLQuery, DSLSchema, dsl_gql
 
+from placedump import pixelqueue
 from placedump.common import ctx_aioredis, get_async_gql_client, handle_backoff, headers
 from placedump.tasks.pixels import update_pixel
 
@@ -18,7 +18,16 @@ running = True
 tasks = []
 
 
+async def drain_legacy():
+    async with ctx_aioredis() as redis:
+        moved = await pixelqueue.adrain_legacy(redis)
+        if moved:
+            log.info("moved %s pixels from the legacy queue", moved)
+
+
 async def main():
+    await drain_legacy()
+
     for x in range(0, 4):
         tasks.append(asyncio.create_task(graphql_parser()))
 
@@ -108,9 +117,13 @@ async def graphql_parser():
             while running:
                 variables = {}
 
-                pairs_raw = await redis.spop("queue:pixels", 24)
-                for index, pixel in enumerate(pairs_raw):
-                    pixels_index["input" + str(index + 1)] = json.loads(pixel)
+                pixels = await pixelqueue.apop(redis, 24)
+                for index, (board, x, y) in enumerate(pixels):
+                    pixels_index["input" + str(index + 1)] = {
+                        "board": board,
+                        "x": x,
+                        "y": y,
+                    }
 
                 # sleep if we have no pixels
                 if len(pixels_index) == 0:
@@ -138,7 +151,7 @@ async def graphql_parser():
                 log.info(
                     "batch completed, batch: %s remaining: %s",
                     len(pixels_index),
-                    await redis.scard("queue:pixels"),
+                    await pixelqueue.apending(redis),
                 )
 
                 pixels_index.clear()
@@ -0,0 +1,318 @@
+import datetime
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import zstandard
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "output")
+MAX_FILE_SIZE = 1024 * 1024 * 256  # 256MB log files.
+MAX_FILE_AGE = int(os.environ.get("ARCHIVE_MAX_AGE", "3600"))
+FRAME_SIZE = 1024 * 1024  # 1MB of messages per zstd frame.
+COMPRESSION_LEVEL = 8
+LAST_KEY = "snakebin:last"
+INDEX_SUFFIX = ".idx"
+
+Message = Tuple[bytes, dict]
+
+
+def message_canvas_id(message) -> str:
+    # Text messages written without the stream field carry it in the JSON.
+    try:
+        payload = json.loads(message)
+    except ValueError:
+        return ""
+
+    canvas_id = payload.get("canvas_id") if isinstance(payload, dict) else None
+    return "" if canvas_id is None else str(canvas_id)
+
+
+def fields_canvas_id(fields: dict) -> bytes:
+    canvas_id = fields.get(b"canvas_id")
+    if canvas_id is None:
+        canvas_id = message_canvas_id(fields[b"message"]).encode()
+
+    return canvas_id
+
+
+def format_line(message_id: bytes, fields: dict, canvas_id: bytes = None) -> bytes:
+    # One message per line: stream id, canvas id, message.
+    if canvas_id is None:
+        canvas_id = fields_canvas_id(fields)
+
+    return b"%s\t%s\t%s\n" % (message_id, canvas_id, fields[b"message"])
+
+
+def parse_line(line: bytes) -> Tuple[str, str, str]:
+    message_id, canvas_id, message = line.decode().split("\t", 2)
+    return message_id, canvas_id, message
+
+
+def stream_id_ms(message_id) -> int:
+    if isinstance(message_id, bytes):
+        message_id = message_id.decode()
+    return int(message_id.split("-", 1)[0])
+
+
+def segment_name(started: float) -> str:
+    return "%d-logs-%s.txt.zst" % (
+        started,
+        datetime.datetime.fromtimestamp(started).strftime("%Y-%m-%d-%H-%M-%S"),
+    )
+
+
+class SegmentWriter:
+    """Writes archived messages into rotating, seekable zstd segments.
+
+    Every segment is a series of independently decompressible zstd frames of
+    about `FRAME_SIZE` bytes each, with a sidecar `.idx` file listing the
+    offset, stream id range, time range and canvases of every frame.
+
+    Compression and file IO happen on a worker thread. Segments are written to
+    `.tmp` files and renamed once complete, `on_flush` is called with the last
+    stream id of every finished segment so it can be checkpointed.
+    """
+
+    def __init__(
+        self,
+        on_flush: Callable[[bytes], None],
+        directory: str = ARCHIVE_DIR,
+        max_size: int = MAX_FILE_SIZE,
+        max_age: int = MAX_FILE_AGE,
+        frame_size: int = FRAME_SIZE,
+    ):
+        self.on_flush = on_flush
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.frame_size = frame_size
+
+        self.queue: queue.Queue = queue.Queue(maxsize=16)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+
+        self.path: Optional[str] = None
+        self.started = 0.0
+        self.raw_file = None
+        self.index = []
+        self.last_id: Optional[bytes] = None
+
+        # Messages waiting for the next frame.
+        self.lines = []
+        self.frame_bytes = 0
+        self.frame_canvases = set()
+        self.frame_first_id: Optional[bytes] = None
+        self.frame_last_id: Optional[bytes] = None
+
+        self.bytes_read = 0
+        self.processed = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._remove_partial()
+
+    def start(self):
+        self.thread.start()
+
+    def write(self, messages: List[Message]):
+        # Blocks when the worker falls behind.
+        self.queue.put(messages)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _remove_partial(self):
+        # Unfinished segments are re-read from the last checkpoint.
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith(".tmp") or (
+                filename.endswith(INDEX_SUFFIX)
+                and not os.path.exists(path[: -len(INDEX_SUFFIX)])
+            ):
+                log.info("removing partial segment %s", filename)
+                os.remove(path)
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                item = []
+
+            if item is None:
+                self._finish()
+                return
+
+            if item:
+                self._write(item)
+            else:
+                # Nothing new, don't leave a partial frame waiting.
+                self._write_frame()
+
+            if self.raw_file and (
+                self.raw_file.tell() >= self.max_size
+                or time.time() - self.started >= self.max_age
+            ):
+                self._finish()
+
+    def _open(self):
+        self.started = time.time()
+        self.path = os.path.join(self.directory, segment_name(self.started))
+        self.raw_file = open(self.path + ".tmp", "wb")
+        self.index = []
+        log.info("starting segment %s", self.path)
+
+    def _write(self, messages: List[Message]):
+        for message_id, fields in messages:
+            canvas_id = fields_canvas_id(fields)
+            line = format_line(message_id, fields, canvas_id)
+
+            if self.frame_first_id is None:
+                self.frame_first_id = message_id
+            self.frame_last_id = message_id
+            self.frame_canvases.add(canvas_id.decode())
+            self.lines.append(line)
+            self.frame_bytes += len(line)
+
+            if self.frame_bytes >= self.frame_size:
+                self._write_frame()
+
+        self.last_id = messages[-1][0]
+        self.processed += len(messages)
+
+    def _write_frame(self):
+        if not self.lines:
+            return
+
+        if not self.raw_file:
+            self._open()
+
+        data = b"".join(self.lines)
+
+        offset = self.raw_file.tell()
+        self.raw_file.write(self.compressor.compress(data))
+
+        self.index.append(
+            {
+                "offset": offset,
+                "length": self.raw_file.tell() - offset,
+                "count": len(self.lines),
+                "first_id": self.frame_first_id.decode(),
+                "last_id": self.frame_last_id.decode(),
+                "start": stream_id_ms(self.frame_first_id),
+                "end": stream_id_ms(self.frame_last_id),
+                "canvases": sorted(self.frame_canvases),
+            }
+        )
+
+        self.bytes_read += len(data)
+        self.lines = []
+        self.frame_bytes = 0
+        self.frame_canvases = set()
+        self.frame_first_id = None
+        self.frame_last_id = None
+
+    def _finish(self):
+        self._write_frame()
+
+        if not self.raw_file:
+            return
+
+        # Make the segment durable, then publish the index before the segment.
+        self.raw_file.flush()
+        os.fsync(self.raw_file.fileno())
+        size = self.raw_file.tell()
+        self.raw_file.close()
+
+        index_path = self.path + INDEX_SUFFIX
+        with open(index_path + ".tmp", "w") as f:
+            for entry in self.index:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(index_path + ".tmp", index_path)
+        os.rename(self.path + ".tmp", self.path)
+
+        log.info(
+            "finished segment %s, %s frames, %s bytes read, %s bytes written, %s processed",
+            self.path,
+            len(self.index),
+            self.bytes_read,
+            size,
+            self.processed,
+        )
+
+        self.on_flush(self.last_id)
+        self.raw_file = None
+
+
+@lru_cache(maxsize=1024)
+def _load_index(path: str, mtime: float) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def load_index(segment: str) -> List[dict]:
+    index_path = segment + INDEX_SUFFIX
+    return _load_index(index_path, os.path.getmtime(index_path))
+
+
+def list_segments(directory: str = ARCHIVE_DIR) -> List[str]:
+    # Segments from before indexing have no sidecar and are skipped.
+    segments = [
+        path[: -len(INDEX_SUFFIX)]
+        for path in glob.glob(os.path.join(directory, "*.txt.zst" + INDEX_SUFFIX))
+    ]
+
+    return sorted(segment for segment in segments if os.path.exists(segment))
+
+
+def read_frame(segment: str, entry: dict) -> List[bytes]:
+    with open(segment, "rb") as f:
+        f.seek(entry["offset"])
+        data = f.read(entry["length"])
+
+    return zstandard.ZstdDecompressor().decompress(data).splitlines()
+
+
+def read_range(
+    start_ts: int,
+    end_ts: int,
+    canvas=None,
+    directory: str = ARCHIVE_DIR,
+) -> Iterator[Tuple[str, str, str]]:
+    """Yield (stream id, canvas id, message) for archived messages in a range.
+
+    Timestamps are unix milliseconds, matched against the stream id and
+    inclusive on both ends. Only frames overlapping the range, and holding the
+    canvas when one is given, are decompressed. Lines archived without a
+    canvas id get it from the message.
+    """
+    canvas = None if canvas is None else str(canvas)
+
+    for segment in list_segments(directory):
+        for entry in load_index(segment):
+            if entry["end"] < start_ts or entry["start"] > end_ts:
+                continue
+            if canvas is not None and not {canvas, ""} & set(entry["canvases"]):
+                continue
+
+            for line in read_frame(segment, entry):
+                message_id, canvas_id, message = parse_line(line)
+                if not start_ts <= stream_id_ms(message_id) <= end_ts:
+                    continue
+                if not canvas_id:
+                    canvas_id = message_canvas_id(message)
+                if canvas is not None and canvas_id != canvas:
+                    continue
+
+                yield message_id, canvas_id, message
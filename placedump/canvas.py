@@ -0,0 +1,336 @@
+import json
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    TYPE_CHECKING,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from PIL import Image
+
+from placedump.archive import ARCHIVE_DIR, read_range
+from placedump.framecache import get_cache
+from placedump.frames import extract_routing, frame_header
+from placedump.layout import Offsets, get_offsets
+from placedump.palette import TRANSPARENT, Palette, get_palette
+from placedump.tasks.parse import get_canvas_id
+
+if TYPE_CHECKING:
+    # decodepool sizes its slots from BOARD_SIZE.
+    from placedump.decodepool import DecodePool
+
+log = logging.getLogger(__name__)
+
+FULL_FRAME = "FullFrameMessageData"
+DIFF_FRAME = "DiffFrameMessageData"
+BOARD_SIZE = 1000
+DECODE_WORKERS = 8
+# Frames decoded ahead of the one being applied.
+PREFETCH = 64
+
+
+class Frame(NamedTuple):
+    board: int
+    kind: str
+    url: str
+    # currentTimestamp for diffs, timestamp for full frames. Unix ms.
+    timestamp: float
+    # previousTimestamp for diffs, None for full frames.
+    previous: Optional[float]
+
+
+# Rows, columns and palette indexes of the pixels a diff frame changes.
+Changes = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class BoardState:
+    """One board's pixels as palette indexes, and the last frame's timestamp."""
+
+    def __init__(self, width: int = BOARD_SIZE, height: int = BOARD_SIZE):
+        self.pixels = np.full((height, width), TRANSPARENT, dtype=np.uint8)
+        self.timestamp: Optional[float] = None
+        self.gaps = 0
+
+    def apply_full(self, frame: Frame, image: np.ndarray):
+        if image.shape != self.pixels.shape:
+            self.pixels = np.empty_like(image)
+        np.copyto(self.pixels, image)
+        self.timestamp = frame.timestamp
+
+    def apply_diff(self, frame: Frame, changes: Changes):
+        # A diff that doesn't follow on from our state means frames are missing.
+        if frame.previous is not None and frame.previous != self.timestamp:
+            self.gaps += 1
+            log.debug("board %s gap before %s", frame.board, frame.url)
+
+        ys, xs, indexes = changes
+        self.pixels[ys, xs] = indexes
+        self.timestamp = frame.timestamp
+
+    def to_image(self, palette: Palette) -> Image.Image:
+        return palette.to_image(self.pixels)
+
+
+def parse_frame(canvas_id: str, message: str) -> Optional[Frame]:
+    """Build a Frame from an archived message, None if it isn't one."""
+    routing = extract_routing(message)
+    kind = routing.get("typename")
+    if kind not in (FULL_FRAME, DIFF_FRAME) or "name" not in routing:
+        return None
+
+    if canvas_id.isdigit():
+        board = int(canvas_id)
+    else:
+        # Messages from before raw frames only carry the subscription id.
+        header = frame_header(message)
+        if header and header[1] is not None:
+            board = get_canvas_id({"id": header[1]})
+        else:
+            board = get_canvas_id(json.loads(message))
+
+    if kind == FULL_FRAME:
+        return Frame(board, kind, routing["name"], float(routing["timestamp"]), None)
+
+    return Frame(
+        board,
+        kind,
+        routing["name"],
+        float(routing["currentTimestamp"]),
+        float(routing["previousTimestamp"]),
+    )
+
+
+def iter_frames(
+    start_ts: int,
+    end_ts: int,
+    canvas=None,
+    directory: str = ARCHIVE_DIR,
+) -> Iterator[Frame]:
+    # The same frame arrives once per subscription, keep the first.
+    seen = set()
+
+    for _, canvas_id, message in read_range(start_ts, end_ts, canvas, directory):
+        frame = parse_frame(canvas_id, message)
+        if frame and frame.url not in seen:
+            seen.add(frame.url)
+            yield frame
+
+
+def decode_frame(data: bytes, palette: Palette) -> np.ndarray:
+    return palette.decode(BytesIO(data))
+
+
+def decode_diff(data: bytes, palette: Palette) -> Changes:
+    # Diffs are mostly transparent, keep only the pixels they change so
+    # applying one costs the number of changes rather than the board size.
+    return diff_changes(decode_frame(data, palette))
+
+
+def diff_changes(indexed: np.ndarray) -> Changes:
+    width = indexed.shape[1]
+    changed = np.flatnonzero(indexed.reshape(-1) != TRANSPARENT)
+    ys, xs = np.divmod(changed, width)
+    return ys, xs, indexed.reshape(-1)[changed]
+
+
+def order_frames(
+    frames: Iterable[Frame],
+    at: Optional[float] = None,
+    from_latest: bool = True,
+    seeded: Optional[Dict[int, float]] = None,
+) -> List[Frame]:
+    """Pick the frames needed to rebuild each board at `at`, in apply order.
+
+    Each board starts from its latest full frame at or before `at`, or its
+    first one without `from_latest`, and applies the frames after it by
+    timestamp. A full frame sorts before a diff with the same timestamp.
+    Boards in `seeded` already have a state at the given timestamp, they
+    only take frames after it and don't need a full frame.
+    """
+    seeded = seeded or {}
+    boards: Dict[int, List[Frame]] = {}
+    for frame in frames:
+        if at is not None and frame.timestamp > at:
+            continue
+        if frame.board in seeded and frame.timestamp <= seeded[frame.board]:
+            continue
+        boards.setdefault(frame.board, []).append(frame)
+
+    ordered = []
+    for board_frames in boards.values():
+        board_frames.sort(
+            key=lambda frame: (
+                frame.timestamp,
+                frame.kind != FULL_FRAME,
+            )
+        )
+
+        start = None
+        for index, frame in enumerate(board_frames):
+            if frame.kind == FULL_FRAME:
+                start = index
+                if not from_latest:
+                    break
+        if start is None and board_frames[0].board in seeded:
+            start = 0
+        if start is None:
+            log.warning("board %s has no full frame, skipping", board_frames[0].board)
+            continue
+
+        ordered.extend(board_frames[start:])
+
+    ordered.sort(key=lambda frame: frame.timestamp)
+    return ordered
+
+
+class Reconstructor:
+    """Rebuilds boards by compositing diff frames onto full frames.
+
+    Frames are fetched through the frame cache and decoded to palette
+    indexes on a thread pool ahead of the compositing loop, diffs down to just
+    their changed pixels. Compositing stays on one thread so frames are
+    applied strictly in order.
+
+    With a `decoder`, frames are fetched and decoded on its processes
+    instead, using its fetch and palette. It is closed with the
+    reconstructor.
+    """
+
+    def __init__(
+        self,
+        fetch: Optional[Callable[[str], bytes]] = None,
+        workers: int = DECODE_WORKERS,
+        palette: Optional[Palette] = None,
+        decoder: Optional["DecodePool"] = None,
+    ):
+        self.fetch = fetch or get_cache().get_url
+        self.palette = palette or get_palette()
+        self.decoder = decoder
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.boards: Dict[int, BoardState] = {}
+
+    def seed(self, board: int, state: BoardState):
+        # Start a board from a known state, e.g. a snapshot.
+        self.boards[board] = state
+
+    def seeded(self) -> Dict[int, float]:
+        return {
+            index: board.timestamp
+            for index, board in self.boards.items()
+            if board.timestamp is not None
+        }
+
+    def _load(self, frame: Frame) -> Union[np.ndarray, Changes]:
+        data = self.fetch(frame.url)
+        if frame.kind == FULL_FRAME:
+            return decode_frame(data, self.palette)
+
+        return decode_diff(data, self.palette)
+
+    def decoded(self, frames: List[Frame]) -> Iterator[Tuple[Frame, Any]]:
+        """Decode frames ahead, yielding them in order with their pixels."""
+        if self.decoder:
+            yield from self._decoded_shared(frames)
+            return
+
+        pending = deque()
+        frames = iter(frames)
+
+        for frame in frames:
+            pending.append((frame, self.pool.submit(self._load, frame)))
+            if len(pending) >= PREFETCH:
+                break
+
+        while pending:
+            frame, future = pending.popleft()
+            next_frame = next(frames, None)
+            if next_frame:
+                pending.append((next_frame, self.pool.submit(self._load, next_frame)))
+
+            yield frame, future.result()
+
+    def _decoded_shared(self, frames: List[Frame]) -> Iterator[Tuple[Frame, Any]]:
+        handles = self.decoder.imap(frame.url for frame in frames)
+        for frame, handle in zip(frames, handles):
+            # Full frames are copied onto the board before the slot is freed.
+            with handle:
+                if frame.kind == FULL_FRAME:
+                    yield frame, handle.array
+                else:
+                    yield frame, diff_changes(handle.array)
+
+    def apply(self, frame: Frame, decoded) -> BoardState:
+        board = self.boards.get(frame.board)
+
+        if frame.kind == FULL_FRAME:
+            if board is None:
+                height, width = decoded.shape
+                board = self.boards[frame.board] = BoardState(width, height)
+            board.apply_full(frame, decoded)
+        elif board is not None:
+            board.apply_diff(frame, decoded)
+
+        return board
+
+    def replay(self, frames: Iterable[Frame]) -> Iterator[Tuple[Frame, BoardState]]:
+        """Apply frames in order, yielding each board's state as it changes."""
+        ordered = order_frames(frames, from_latest=False, seeded=self.seeded())
+        for frame, image in self.decoded(ordered):
+            board = self.apply(frame, image)
+            if board is not None:
+                yield frame, board
+
+    def reconstruct(
+        self, frames: Iterable[Frame], at: Optional[float] = None
+    ) -> Dict[int, BoardState]:
+        """Rebuild every board as of `at` (unix ms), or after all frames."""
+        ordered = order_frames(frames, at, seeded=self.seeded())
+        for frame, image in self.decoded(ordered):
+            self.apply(frame, image)
+
+        return self.boards
+
+    def close(self):
+        self.pool.shutdown()
+        if self.decoder:
+            self.decoder.close()
+
+
+def compose(
+    boards: Dict[int, BoardState], offsets: Optional[Offsets] = None
+) -> np.ndarray:
+    """Lay boards out on one indexed canvas at their offsets.
+
+    Offsets default to the live config's, boards without one are left out.
+    """
+    offsets = offsets or get_offsets()
+    placed = []
+    for index, board in sorted(boards.items()):
+        if index not in offsets:
+            log.warning("board %s has no offset, leaving it out", index)
+            continue
+        placed.append((offsets[index], board))
+    if not placed:
+        raise ValueError("no boards with known offsets to compose")
+
+    width = max(x + board.pixels.shape[1] for (x, _), board in placed)
+    height = max(y + board.pixels.shape[0] for (_, y), board in placed)
+
+    canvas = np.full((height, width), TRANSPARENT, dtype=np.uint8)
+    for (x, y), board in placed:
+        board_height, board_width = board.pixels.shape
+        canvas[y : y + board_height, x : x + board_width] = board.pixels
+
+    return canvas
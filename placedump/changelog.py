@@ -0,0 +1,305 @@
+import glob
+import json
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import zstandard
+
+from placedump.archive import INDEX_SUFFIX, load_index
+from placedump.canvas import DIFF_FRAME, Frame, Reconstructor
+
+log = logging.getLogger(__name__)
+
+CHANGELOG_DIR = os.environ.get("CHANGELOG_DIR", "changelog")
+# Changes per chunk, each chunk is one zstd frame covering one tile of a board.
+CHUNK_ROWS = int(os.environ.get("CHANGELOG_CHUNK_ROWS", "65536"))
+TILE_SIZE = int(os.environ.get("CHANGELOG_TILE_SIZE", "250"))
+COMPRESSION_LEVEL = 10
+
+CHANGE_DTYPE = np.dtype(
+    [
+        ("board", "u1"),
+        ("x", "u2"),
+        ("y", "u2"),
+        ("color", "u1"),
+        ("timestamp", "i8"),
+    ]
+)
+# Region is x0, y0, x1, y1 with the end exclusive.
+Region = Tuple[int, int, int, int]
+
+
+def log_name(first_ts: int) -> str:
+    return "%d-changes.chl" % first_ts
+
+
+class ChangeLogWriter:
+    """Writes pixel changes into a chunked, columnar, compressed log.
+
+    Changes are grouped by board and `tile` x `tile` tile and written in
+    chunks of up to `chunk_rows`, each one zstd frame holding the columns
+    back to back: timestamp offsets from the chunk's start, x, y and colour
+    index. A sidecar `.idx` lists every chunk's offset, board, tile, bounding
+    box and time range so readers only decompress the chunks they need.
+
+    Like archive segments, the log is written to a `.tmp` file and renamed
+    with its index on `close`.
+    """
+
+    def __init__(
+        self,
+        directory: str = CHANGELOG_DIR,
+        chunk_rows: int = CHUNK_ROWS,
+        tile: int = TILE_SIZE,
+    ):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.tile = tile
+        self.compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+
+        self.path: Optional[str] = None
+        self.raw_file = None
+        self.index: List[dict] = []
+        # Per (board, tile x, tile y): pending column arrays and row count.
+        self.buffers: Dict[Tuple[int, int, int], List[Tuple[np.ndarray, ...]]] = {}
+        self.counts: Dict[Tuple[int, int, int], int] = {}
+        self.written = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def add(
+        self,
+        board: int,
+        timestamp: float,
+        xs: np.ndarray,
+        ys: np.ndarray,
+        colors: np.ndarray,
+    ):
+        """Record one frame's changes, frames should come in timestamp order."""
+        if not len(xs):
+            return
+
+        if not self.raw_file:
+            self._open(int(timestamp))
+
+        # Split the frame's pixels by tile with one sort.
+        tiles = (xs // self.tile) * 65536 + ys // self.tile
+        order = np.argsort(tiles, kind="stable")
+        tiles, xs, ys, colors = tiles[order], xs[order], ys[order], colors[order]
+        starts = np.flatnonzero(np.diff(tiles, prepend=-1))
+        ends = np.append(starts[1:], len(tiles))
+
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            tile_x, tile_y = divmod(int(tiles[start]), 65536)
+            key = (board, tile_x, tile_y)
+            timestamps = np.full(end - start, int(timestamp), dtype=np.int64)
+
+            self.buffers.setdefault(key, []).append(
+                (timestamps, xs[start:end], ys[start:end], colors[start:end])
+            )
+            self.counts[key] = self.counts.get(key, 0) + end - start
+            if self.counts[key] >= self.chunk_rows:
+                self._write_chunk(key)
+
+    def close(self):
+        for key in sorted(self.buffers):
+            self._write_chunk(key)
+
+        if not self.raw_file:
+            return
+
+        self.raw_file.flush()
+        os.fsync(self.raw_file.fileno())
+        size = self.raw_file.tell()
+        self.raw_file.close()
+
+        index_path = self.path + INDEX_SUFFIX
+        with open(index_path + ".tmp", "w") as f:
+            for entry in self.index:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(index_path + ".tmp", index_path)
+        os.rename(self.path + ".tmp", self.path)
+
+        log.info(
+            "finished change log %s, %s changes in %s chunks, %s bytes",
+            self.path,
+            self.written,
+            len(self.index),
+            size,
+        )
+        self.raw_file = None
+
+    def _open(self, first_ts: int):
+        self.path = os.path.join(self.directory, log_name(first_ts))
+        self.raw_file = open(self.path + ".tmp", "wb")
+        self.index = []
+        log.info("starting change log %s", self.path)
+
+    def _write_chunk(self, key: Tuple[int, int, int]):
+        parts = self.buffers.pop(key, None)
+        self.counts.pop(key, None)
+        if not parts:
+            return
+
+        timestamps, xs, ys, colors = [np.concatenate(column) for column in zip(*parts)]
+        start = int(timestamps.min())
+        if timestamps.max() - start >= 1 << 32:
+            raise ValueError(f"chunk for {key} spans more than 2^32 ms")
+
+        data = b"".join(
+            [
+                (timestamps - start).astype("<u4").tobytes(),
+                xs.astype("<u2").tobytes(),
+                ys.astype("<u2").tobytes(),
+                colors.astype("u1").tobytes(),
+            ]
+        )
+
+        offset = self.raw_file.tell()
+        self.raw_file.write(self.compressor.compress(data))
+
+        board, tile_x, tile_y = key
+        self.index.append(
+            {
+                "offset": offset,
+                "length": self.raw_file.tell() - offset,
+                "count": len(xs),
+                "board": board,
+                "tile": [tile_x, tile_y],
+                "x_min": int(xs.min()),
+                "x_max": int(xs.max()),
+                "y_min": int(ys.min()),
+                "y_max": int(ys.max()),
+                "start": start,
+                "end": int(timestamps.max()),
+            }
+        )
+        self.written += len(xs)
+
+
+def list_logs(directory: str = CHANGELOG_DIR) -> List[str]:
+    logs = [
+        path[: -len(INDEX_SUFFIX)]
+        for path in glob.glob(os.path.join(directory, "*.chl" + INDEX_SUFFIX))
+    ]
+
+    return sorted(path for path in logs if os.path.exists(path))
+
+
+def read_chunk(path: str, entry: dict) -> np.ndarray:
+    with open(path, "rb") as f:
+        f.seek(entry["offset"])
+        data = zstandard.ZstdDecompressor().decompress(f.read(entry["length"]))
+
+    count = entry["count"]
+    timestamps = np.frombuffer(data, "<u4", count, 0)
+    xs = np.frombuffer(data, "<u2", count, count * 4)
+    ys = np.frombuffer(data, "<u2", count, count * 6)
+    colors = np.frombuffer(data, "u1", count, count * 8)
+
+    changes = np.empty(count, dtype=CHANGE_DTYPE)
+    changes["board"] = entry["board"]
+    changes["x"] = xs
+    changes["y"] = ys
+    changes["color"] = colors
+    changes["timestamp"] = timestamps.astype(np.int64) + entry["start"]
+    return changes
+
+
+def _overlaps(
+    entry: dict,
+    board: Optional[int],
+    region: Optional[Region],
+    start: Optional[int],
+    end: Optional[int],
+) -> bool:
+    if board is not None and entry["board"] != board:
+        return False
+    if start is not None and entry["end"] < start:
+        return False
+    if end is not None and entry["start"] > end:
+        return False
+    if region is not None:
+        x0, y0, x1, y1 = region
+        if entry["x_max"] < x0 or entry["x_min"] >= x1:
+            return False
+        if entry["y_max"] < y0 or entry["y_min"] >= y1:
+            return False
+
+    return True
+
+
+def read_changes(
+    board: Optional[int] = None,
+    region: Optional[Region] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    directory: str = CHANGELOG_DIR,
+) -> Iterator[np.ndarray]:
+    """Yield arrays of CHANGE_DTYPE matching a board, region and time range.
+
+    Timestamps are unix ms, inclusive on both ends. Only chunks whose index
+    entry overlaps the query are read. Each array is one chunk, in time
+    order within it but not across chunks.
+    """
+    for path in list_logs(directory):
+        for entry in load_index(path):
+            if not _overlaps(entry, board, region, start, end):
+                continue
+
+            changes = read_chunk(path, entry)
+            mask = np.ones(len(changes), dtype=bool)
+            if start is not None:
+                mask &= changes["timestamp"] >= start
+            if end is not None:
+                mask &= changes["timestamp"] <= end
+            if region is not None:
+                x0, y0, x1, y1 = region
+                mask &= (changes["x"] >= x0) & (changes["x"] < x1)
+                mask &= (changes["y"] >= y0) & (changes["y"] < y1)
+
+            if mask.any():
+                yield changes[mask]
+
+
+def load_changes(*args, **kwargs) -> np.ndarray:
+    """Like read_changes, as one array sorted by timestamp."""
+    chunks = list(read_changes(*args, **kwargs))
+    if not chunks:
+        return np.empty(0, dtype=CHANGE_DTYPE)
+
+    changes = np.concatenate(chunks)
+    return changes[np.argsort(changes["timestamp"], kind="stable")]
+
+
+def build(
+    writer: ChangeLogWriter, frames: Iterable[Frame], reconstructor: Reconstructor
+) -> int:
+    """Write every diff frame's pixels to the log in timestamp order.
+
+    Changes carry their diff frame's timestamp, so times are as precise as
+    the frame interval. Returns the number of gaps between diffs, where
+    changes were missed.
+    """
+    diffs = sorted(
+        (frame for frame in frames if frame.kind == DIFF_FRAME),
+        key=lambda frame: frame.timestamp,
+    )
+    last: Dict[int, float] = {}
+    gaps = 0
+
+    for frame, (ys, xs, indexes) in reconstructor.decoded(diffs):
+        previous = last.get(frame.board)
+        if previous is not None and frame.previous != previous:
+            gaps += 1
+            log.debug("board %s gap before %s", frame.board, frame.url)
+        last[frame.board] = frame.timestamp
+
+        writer.add(frame.board, frame.timestamp, xs, ys, indexes)
+
+    return gaps
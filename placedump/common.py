@@ -14,8 +14,11 @@ from b2sdk.v2 import B2Api, InMemoryAccountInfo
 from gql import Client
 from gql.transport.aiohttp import AIOHTTPTransport
 from gql.transport.websockets import WebsocketsTransport
+from graphql import ExecutionResult
 from redis import asyncio as aioredis
 
+from placedump.frames import RAW_FRAME_KEY, frame_header
+
 REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost")
 TOKEN_REGEX = re.compile(r'"accessToken":"([^"]+)"')
 headers = {"User-Agent": "r/place archiver u/nepeat nepeat#0001"}
@@ -105,11 +108,29 @@ def get_gql_client(token: Optional[str] = None) -> Client:
     return Client(transport=transport, fetch_schema_from_transport=False)
 
 
+class RawFrameTransport(WebsocketsTransport):
+    """Websocket transport that hands data frames over undecoded.
+
+    Subscriptions yield `{RAW_FRAME_KEY: frame}` with the frame text exactly as
+    received. Anything that isn't a plain data frame is parsed as usual.
+    """
+
+    def _parse_answer(self, answer: str):
+        header = frame_header(answer)
+
+        if header and header[0] == "data" and header[1] is not None:
+            if '"errors"' not in answer:
+                return "data", header[1], ExecutionResult(data={RAW_FRAME_KEY: answer})
+
+        return super()._parse_answer(answer)
+
+
 @asynccontextmanager
-async def get_async_gql_client() -> Client:
+async def get_async_gql_client(raw: bool = False) -> Client:
     token = await get_token()
+    transport_class = RawFrameTransport if raw else WebsocketsTransport
 
-    transport = WebsocketsTransport(
+    transport = transport_class(
         url="wss://gql-realtime-2.reddit.com/query",
         headers={
             "Authorization": f"Bearer {token}",
@@ -0,0 +1,213 @@
+import logging
+import os
+import threading
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from placedump.canvas import BOARD_SIZE
+from placedump.framecache import get_cache
+from placedump.palette import Palette, get_palette
+
+log = logging.getLogger(__name__)
+
+POOL_WORKERS = int(os.environ.get("DECODE_POOL_WORKERS", str(os.cpu_count() or 1)))
+# Decoded frames held at once, in flight or with the caller. Docker's
+# default /dev/shm is 64MB, the default stays under it with 1MB slots.
+POOL_SLOTS = int(os.environ.get("DECODE_POOL_SLOTS", str(min(POOL_WORKERS * 2, 48))))
+# Bytes per slot, one palette index per pixel of a board.
+SLOT_SIZE = int(os.environ.get("DECODE_SLOT_SIZE", str(BOARD_SIZE * BOARD_SIZE)))
+
+# Per worker process, set up by _init_worker.
+_shm: Optional[SharedMemory] = None
+_slot_size = 0
+_fetch: Optional[Callable[[str], bytes]] = None
+_palette: Optional[Palette] = None
+
+
+def fetch_url(url: str) -> bytes:
+    return get_cache().get_url(url)
+
+
+def fetch_digest(digest: str) -> bytes:
+    return get_cache().get(digest)
+
+
+def _init_worker(
+    name: str, slot_size: int, fetch: Callable[[str], bytes], colors: list
+):
+    global _shm, _slot_size, _fetch, _palette
+
+    _shm = SharedMemory(name=name)
+    _slot_size = slot_size
+    _fetch = fetch
+    _palette = Palette(colors)
+
+
+def _decode(slot: int, key: str) -> Tuple[int, ...]:
+    indexed = _palette.decode(_fetch(key))
+    if indexed.nbytes > _slot_size:
+        raise ValueError(f"{key} is {indexed.shape}, larger than a slot")
+
+    out = np.ndarray(
+        indexed.shape, dtype=np.uint8, buffer=_shm.buf, offset=slot * _slot_size
+    )
+    np.copyto(out, indexed)
+    return indexed.shape
+
+
+class Handle:
+    """A decoded frame in a shared memory slot.
+
+    `array` is a view of the slot, valid until the handle is released. Use
+    it as a context manager, or call `release`, as soon as it's done with.
+    """
+
+    def __init__(
+        self,
+        pool: "DecodePool",
+        key: str,
+        slot: Optional[int],
+        shape: Tuple[int, ...] = (),
+        error: Optional[BaseException] = None,
+    ):
+        self.pool = pool
+        self.key = key
+        self.slot = slot
+        self.shape = shape
+        self.error = error
+
+    @property
+    def array(self) -> np.ndarray:
+        if self.error:
+            raise self.error
+        if self.slot is None:
+            raise ValueError(f"{self.key} was already released")
+
+        return np.ndarray(
+            self.shape,
+            dtype=np.uint8,
+            buffer=self.pool.shm.buf,
+            offset=self.slot * self.pool.slot_size,
+        )
+
+    def release(self):
+        if self.slot is not None:
+            self.pool._release(self.slot)
+            self.slot = None
+
+    def __enter__(self) -> "Handle":
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class DecodePool:
+    """Decodes frames to palette indexes on every core.
+
+    Workers fetch and decode frames and write the result straight into a
+    slot of one shared memory block, only the shape is sent back, so no
+    pixels are pickled between processes. At most `slots` frames are
+    decoded or held by the caller at once, `imap` waits for handles to be
+    released before decoding further ahead.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], bytes] = fetch_url,
+        palette: Optional[Palette] = None,
+        workers: int = POOL_WORKERS,
+        slots: int = POOL_SLOTS,
+        slot_size: int = SLOT_SIZE,
+    ):
+        palette = palette or get_palette()
+        self.slot_size = slot_size
+        self.shm = SharedMemory(create=True, size=slots * slot_size)
+        self.free: List[int] = list(range(slots))
+        self.lock = threading.Lock()
+
+        # Spawned, forking would copy the parent's Redis, Cassandra and B2
+        # connections and threads into every worker.
+        self.pool = get_context("spawn").Pool(
+            workers,
+            initializer=_init_worker,
+            initargs=(self.shm.name, slot_size, fetch, palette.colors),
+        )
+
+    def _acquire(self) -> Optional[int]:
+        with self.lock:
+            return self.free.pop() if self.free else None
+
+    def _release(self, slot: int):
+        with self.lock:
+            self.free.append(slot)
+
+    def imap(self, keys: Iterable[str]) -> Iterator[Handle]:
+        """Decode frames ahead, yielding a handle for each in order.
+
+        A frame that fails to fetch or decode yields a handle with `error`
+        set, its `array` raises it. Slots of frames still decoding are
+        returned if the caller stops iterating early.
+        """
+        keys = iter(keys)
+        pending = deque()
+        try:
+            yield from self._imap(keys, pending)
+        finally:
+            for _, slot, result in pending:
+                result.wait()
+                self._release(slot)
+
+    def _imap(self, keys: Iterator[str], pending: deque) -> Iterator[Handle]:
+        exhausted = False
+
+        while True:
+            while not exhausted:
+                slot = self._acquire()
+                if slot is None:
+                    break
+
+                key = next(keys, None)
+                if key is None:
+                    self._release(slot)
+                    exhausted = True
+                    break
+
+                pending.append((key, slot, self.pool.apply_async(_decode, (slot, key))))
+
+            if not pending:
+                if exhausted:
+                    return
+                raise RuntimeError("every decode slot is held, release handles")
+
+            key, slot, result = pending.popleft()
+            try:
+                shape = result.get()
+            except Exception as e:
+                log.warning("decoding %s failed: %s", key, e)
+                self._release(slot)
+                yield Handle(self, key, None, error=e)
+                continue
+
+            yield Handle(self, key, slot, shape)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+        try:
+            self.shm.close()
+        except BufferError:
+            # A caller still holds an array view, the mapping goes with it.
+            pass
+        self.shm.unlink()
+
+    def __enter__(self) -> "DecodePool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
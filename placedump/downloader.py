@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import httpx
+
+from placedump import framecache
+from placedump.common import get_redis, headers
+from placedump.storage import PackWriter, store_blob
+from placedump.tasks.pixels import download_url, queue_frame, retry_busy
+from placedump.urls import (
+    BUSY,
+    CLAIMED,
+    claim_url,
+    get_url_writer,
+    new_token,
+    release_url,
+)
+
+log = logging.getLogger(__name__)
+
+DOWNLOAD_CONCURRENCY = int(os.environ.get("DOWNLOAD_CONCURRENCY", "64"))
+UPLOAD_WORKERS = int(os.environ.get("DOWNLOAD_UPLOAD_WORKERS", "32"))
+# Append small frames into shared pack objects instead of one upload each.
+PACK = os.environ.get("DOWNLOAD_PACK", "0") == "1"
+
+Fetched = Tuple[int, str, str, bytes, Future]
+
+
+class Downloader:
+    """Fetches frames and uploads them to B2 from a single asyncio process.
+
+    HTTP requests share a pooled HTTP/2 client, B2 uploads run on a thread
+    pool so many can be in flight, and `urls` rows go through the process's
+    UrlWriter. At most `concurrency` frames are fetched at once.
+
+    With `pack`, small frames from a batch are uploaded together as one pack
+    object and only recorded once the pack is stored.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = DOWNLOAD_CONCURRENCY,
+        upload_workers: int = UPLOAD_WORKERS,
+        pack: bool = PACK,
+    ):
+        self.client = httpx.AsyncClient(
+            http2=True,
+            headers=headers,
+            follow_redirects=True,
+            timeout=30,
+            limits=httpx.Limits(
+                max_connections=concurrency,
+                max_keepalive_connections=concurrency,
+            ),
+        )
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.pool = ThreadPoolExecutor(max_workers=upload_workers)
+        self.redis = get_redis()
+        self.writer = get_url_writer()
+        self.packer = PackWriter() if pack else None
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, func, *args)
+
+    async def download_many(self, downloads: List[Tuple[int, str]]):
+        fetched = await asyncio.gather(
+            *[self.fetch(board, url) for board, url in downloads],
+        )
+
+        # Upload this batch's pack now rather than waiting out its age.
+        if self.packer:
+            await self._run(self.packer.flush)
+
+        await asyncio.gather(*[self.finish(*item) for item in fetched if item])
+
+    async def fetch(self, board: int, url: str) -> Optional[Fetched]:
+        token = new_token()
+
+        # Someone else has the frame or it's done, don't wait on them. Celery
+        # looks at busy ones again once their lease is up.
+        state = await self._run(claim_url, self.redis, url, token)
+        if state == BUSY:
+            await self._run(retry_busy, board, url)
+        if state != CLAIMED:
+            return None
+
+        try:
+            async with self.semaphore:
+                response = await self.client.get(url)
+                response.raise_for_status()
+                data = response.content
+
+                # Upload to B2, identical frames are only stored once.
+                if self.packer:
+                    stored = await self._run(self.packer.store, data)
+                else:
+                    stored = Future()
+                    stored.set_result(await self._run(store_blob, self.redis, data))
+        except Exception:
+            await self.fail(board, url, token)
+            return None
+
+        return board, url, token, data, stored
+
+    async def finish(
+        self, board: int, url: str, token: str, data: bytes, stored: Future
+    ):
+        try:
+            digest, is_new = await asyncio.wrap_future(stored)
+            log.info(f"{url}, {len(data)} bytes, {digest}, new: {is_new}.")
+
+            # Kick off the image parsing loop.
+            if is_new:
+                await self._run(framecache.get_cache().put, digest, data)
+            await self._run(queue_frame, board, url, digest, is_new)
+        except Exception:
+            await self.fail(board, url, token)
+            return
+
+        # Full batches are written inline, keep that off the event loop.
+        await self._run(self.writer.add, url, len(data), digest)
+
+    async def fail(self, board: int, url: str, token: str):
+        # Celery retries with backoff, let it take over failures.
+        log.exception("async download failed for %s, queueing", url)
+        await self._run(release_url, self.redis, url, token)
+        await self._run(download_url.delay, board, url)
+
+    async def flush_rows(self):
+        await self._run(self.writer.flush)
+
+    async def close(self):
+        if self.packer:
+            await self._run(self.packer.flush)
+        await self.flush_rows()
+        await self.client.aclose()
+        self.pool.shutdown()
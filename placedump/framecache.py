@@ -0,0 +1,234 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from io import BytesIO
+from typing import Generator, List, Optional, Tuple, Union
+
+from placedump.storage import download_bytes, get_manifest, legacy_name, read_blob
+
+# Mount the same volume into every worker and tool on a node to share hits.
+CACHE_DIR = os.environ.get("FRAME_CACHE_DIR", "framecache")
+CACHE_SIZE = int(os.environ.get("FRAME_CACHE_SIZE", str(1024 * 1024 * 1024 * 2)))
+# Evict down to this fraction of the limit so every put doesn't rescan.
+EVICT_TARGET = 0.9
+# Processes add what they wrote to the shared size estimate this often.
+SYNC_INTERVAL = 60
+# In the cache directory: the shared size estimate and the lock guarding it.
+SIZE_FILE = ".size"
+LOCK_FILE = ".lock"
+# URL to digest mappings remembered per process, they never change.
+MANIFEST_ENTRIES = int(os.environ.get("FRAME_CACHE_MANIFEST_ENTRIES", "65536"))
+
+
+class FrameCache:
+    """Node-local, size-bounded frame cache keyed by content hash.
+
+    Entries are written atomically with a rename and read through mmap.
+    Reads bump the file's mtime, eviction removes the least recently used
+    entries once the directory grows past `max_size`.
+
+    Any number of processes can share a directory. They keep one size
+    estimate in a file there, each adds the bytes it wrote under a lock
+    every `SYNC_INTERVAL` or once its own view goes over. Only the process
+    that finds the total over the limit scans the directory and evicts.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_size: int = CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        # Shared size as of the last sync, and bytes put since.
+        self.size: Optional[int] = None
+        self.added = 0
+        self.synced = 0.0
+        self.digests: OrderedDict = OrderedDict()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[-2:], f"{key}.png")
+
+    def put(self, key: str, data: bytes) -> str:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temp file first so readers never see a partial frame.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self.added += len(data)
+        self._maybe_evict()
+
+        return path
+
+    @contextmanager
+    def open(self, key: str) -> Generator[Optional[mmap.mmap], None, None]:
+        # Yields None on a miss. The mmap is read-only and file-like.
+        try:
+            f = open(self.path(key), "rb")
+        except FileNotFoundError:
+            yield None
+            return
+
+        with f:
+            os.utime(f.fileno())
+            if os.fstat(f.fileno()).st_size == 0:
+                yield None
+                return
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                yield view
+
+    def get_cached(self, key: str) -> Optional[bytes]:
+        with self.open(key) as view:
+            return None if view is None else view[:]
+
+    def discard(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, digest: str) -> bytes:
+        """Read a frame by hash, falling back to B2 on a miss."""
+        data = self.get_cached(digest)
+        if data is None:
+            data = read_blob(digest)
+            self.put(digest, data)
+
+        return data
+
+    def get_url(self, url: str) -> bytes:
+        """Read a frame by URL through the urls table manifest.
+
+        Cassandra is only asked for URLs this process hasn't resolved and
+        that aren't cached under their URL already.
+        """
+        digest = self.digests.get(url)
+        if digest:
+            return self.get(digest)
+
+        # Frames from before content addressing are cached under the URL.
+        key = url_key(url)
+        data = self.get_cached(key)
+        if data is not None:
+            return data
+
+        digest = get_manifest(url)
+        if digest:
+            self.digests[url] = digest
+            if len(self.digests) > MANIFEST_ENTRIES:
+                self.digests.popitem(last=False)
+            return self.get(digest)
+
+        data = download_bytes(legacy_name(url))
+        self.put(key, data)
+        return data
+
+    @contextmanager
+    def open_frame(
+        self, digest: str
+    ) -> Generator[Union[mmap.mmap, BytesIO], None, None]:
+        # For PIL and friends, avoids copying cached frames into memory.
+        with self.open(digest) as view:
+            if view is not None:
+                yield view
+                return
+
+        yield BytesIO(self.get(digest))
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        results = []
+
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+
+            for entry in os.scandir(subdir.path):
+                # Skip writes still in flight.
+                if entry.name.endswith(".tmp"):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                results.append((stat.st_mtime, stat.st_size, entry.path))
+
+        return results
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _write_size(self):
+        with open(os.path.join(self.directory, SIZE_FILE), "w") as f:
+            f.write(str(self.size))
+
+    def evict(self) -> int:
+        with self._locked():
+            return self._evict()
+
+    def _evict(self) -> int:
+        entries = sorted(self.entries())
+        self.size = sum(size for _, size, _ in entries)
+        self.added = 0
+        self.synced = time.monotonic()
+
+        target = self.max_size * EVICT_TARGET
+        removed = 0
+
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            removed += 1
+
+        self._write_size()
+        return removed
+
+    def _maybe_evict(self):
+        stale = time.monotonic() - self.synced > SYNC_INTERVAL
+        if self.size is None or stale or self.size + self.added > self.max_size:
+            self._sync()
+
+    def _sync(self):
+        with self._locked():
+            try:
+                with open(os.path.join(self.directory, SIZE_FILE)) as f:
+                    shared = int(f.read())
+            except (FileNotFoundError, ValueError):
+                # Nobody has measured the directory yet.
+                self._evict()
+                return
+
+            self.size = shared + self.added
+            self.added = 0
+            self.synced = time.monotonic()
+
+            if self.size > self.max_size:
+                self._evict()
+            else:
+                self._write_size()
+
+
+def url_key(url: str) -> str:
+    return "url-" + hashlib.sha256(url.encode()).hexdigest()
+
+
+@lru_cache
+def get_cache() -> FrameCache:
+    return FrameCache()
@@ -0,0 +1,102 @@
+import logging
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import redis as redis_sync
+
+from placedump import framecache, pixelqueue
+from placedump.palette import TRANSPARENT, get_palette
+
+log = logging.getLogger(__name__)
+
+# canvas-images/{timestamp}-{board}-{f|d}-{id}.png
+FRAME_URL_REGEX = re.compile(r"/(\d+)-(\d+)-([fd])-[^/]+\.png$")
+# Per board hash of the newest full frame seen: timestamp and digest.
+REF_PREFIX = "frames:full:"
+
+# KEYS: reference hash. ARGV: timestamp, digest.
+# Returns the previous digest, and whether this frame replaced it.
+SWAP_SCRIPT = """
+local current = redis.call("HMGET", KEYS[1], "timestamp", "digest")
+local updated = 0
+
+if not current[1] or tonumber(ARGV[1]) > tonumber(current[1]) then
+    redis.call("HSET", KEYS[1], "timestamp", ARGV[1], "digest", ARGV[2])
+    updated = 1
+end
+
+return {current[2] or false, updated}
+"""
+
+# Last decoded full frame per board, the next one almost always diffs
+# against it.
+_decoded: Dict[int, Tuple[str, np.ndarray]] = {}
+_decoded_lock = threading.Lock()
+
+
+def parse_frame_url(url: str) -> Optional[Tuple[int, int, bool]]:
+    """Timestamp, board and whether it's a full frame, from a frame URL."""
+    match = FRAME_URL_REGEX.search(url)
+    if not match:
+        return None
+
+    return int(match.group(1)), int(match.group(2)), match.group(3) == "f"
+
+
+def load_indexed(board: int, digest: str, keep: bool = True) -> np.ndarray:
+    with _decoded_lock:
+        cached = _decoded.get(board)
+    if cached and cached[0] == digest:
+        return cached[1]
+
+    with framecache.get_cache().open_frame(digest) as f_data:
+        indexed = get_palette().decode(f_data)
+
+    if keep:
+        with _decoded_lock:
+            _decoded[board] = (digest, indexed)
+    return indexed
+
+
+def changed_pixels(previous: np.ndarray, current: np.ndarray) -> np.ndarray:
+    """(x, y) of every pixel that differs, one row per pixel.
+
+    The canvas only ever grows, pixels outside the previous frame count as
+    changed if they're drawn on.
+    """
+    height = min(previous.shape[0], current.shape[0])
+    width = min(previous.shape[1], current.shape[1])
+
+    changed = current != TRANSPARENT
+    changed[:height, :width] = current[:height, :width] != previous[:height, :width]
+
+    ys, xs = np.nonzero(changed)
+    return np.stack([xs, ys], axis=1)
+
+
+def diff_full_frame(
+    redis: redis_sync.Redis, board: int, timestamp: int, digest: str
+) -> List[Tuple[int, int]]:
+    """Queue the pixels a full frame changed since the board's last one.
+
+    Full frames can finish out of order, the reference only moves forward.
+    An older frame still diffs against the newer reference, which covers
+    the same pixels a diff the other way would.
+    """
+    script = redis.register_script(SWAP_SCRIPT)
+    previous, updated = script(keys=[REF_PREFIX + str(board)], args=[timestamp, digest])
+
+    if not previous or previous == digest:
+        return []
+
+    # Keep whichever frame is the reference now decoded for the next call.
+    reference = load_indexed(board, previous, keep=not updated)
+    current = load_indexed(board, digest, keep=bool(updated))
+    changed = changed_pixels(reference, current).tolist()
+    if changed:
+        pixelqueue.push(redis, [(board, x, y) for x, y in changed])
+
+    log.info("board %s full frame %s changed %s pixels", board, digest, len(changed))
+    return [tuple(pixel) for pixel in changed]
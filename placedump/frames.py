@@ -0,0 +1,53 @@
+import json
+import re
+from typing import Optional, Tuple
+
+RAW_FRAME_KEY = "raw"
+
+# graphql-ws envelope fields, only trusted when they come before the payload.
+FRAME_TYPE_REGEX = re.compile(r'"type"\s*:\s*"(\w+)"')
+FRAME_ID_REGEX = re.compile(r'"id"\s*:\s*"?(\d+)"?')
+
+# Fields needed to route a frame without decoding it.
+ROUTING_REGEXES = {
+    "typename": re.compile(r'"__typename"\s*:\s*"(\w+MessageData)"'),
+    "name": re.compile(r'"name"\s*:\s*"((?:[^"\\]|\\.)*)"'),
+    "timestamp": re.compile(r'"timestamp"\s*:\s*(-?[\d.eE+-]+)'),
+    "currentTimestamp": re.compile(r'"currentTimestamp"\s*:\s*(-?[\d.eE+-]+)'),
+    "previousTimestamp": re.compile(r'"previousTimestamp"\s*:\s*(-?[\d.eE+-]+)'),
+}
+
+
+def frame_header(raw: str) -> Optional[Tuple[str, Optional[int]]]:
+    """Read the type and id of a graphql-ws frame without decoding it.
+
+    Returns None when the envelope can't be read safely, callers should fall
+    back to a full decode.
+    """
+    envelope = raw.split('"payload"', 1)[0]
+
+    type_match = FRAME_TYPE_REGEX.search(envelope)
+    if not type_match:
+        return None
+
+    id_match = FRAME_ID_REGEX.search(envelope)
+    if not id_match:
+        return type_match.group(1), None
+
+    return type_match.group(1), int(id_match.group(1))
+
+
+def extract_routing(raw: str) -> dict:
+    routing = {}
+
+    for field, regex in ROUTING_REGEXES.items():
+        match = regex.search(raw)
+        if not match:
+            continue
+
+        value = match.group(1)
+        if "\\" in value:
+            value = json.loads('"' + value + '"')
+        routing[field] = value
+
+    return routing
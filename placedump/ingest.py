@@ -0,0 +1,407 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import backoff
+import redis as redis_sync
+
+from placedump.archive import LAST_KEY, stream_id_ms
+from placedump.common import get_redis, handle_backoff
+from placedump.constants import socket_key
+from placedump.frames import extract_routing
+from placedump.tasks import app
+from placedump.tasks.parse import parse_message
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "256"))
+BATCH_DELAY = float(os.environ.get("INGEST_BATCH_DELAY", "0.05"))
+MAX_PENDING = int(os.environ.get("INGEST_MAX_PENDING", "16384"))
+# stream_parser.py reads the stream directly, this keeps the old task hop around.
+CELERY_PARSE = os.environ.get("INGEST_CELERY_PARSE", "0") == "1"
+STREAM_MAXLEN = 2000000
+STATS_KEY = "ingest:stats"
+
+# Spill to disk once the slowest consumer is this close to the trim horizon.
+SPILL_DIR = os.environ.get("INGEST_SPILL_DIR", "spill")
+SPILL_HIGH = int(STREAM_MAXLEN * 0.8)
+SPILL_LOW = int(STREAM_MAXLEN * 0.5)
+SPILL_SEGMENT_SIZE = 1024 * 1024 * 8
+LAG_INTERVAL = 1.0
+# Back off between failed flushes, up to this many seconds.
+FLUSH_RETRY_MAX = 5.0
+
+Item = Tuple[dict, int]
+
+
+def stream_payload(message: str, canvas_id, raw: bool) -> dict:
+    """Stream fields for one websocket message, raw frame or re-encoded text."""
+    payload = {
+        "message": message,
+        "type": "raw" if raw else "text",
+        "canvas_id": str(canvas_id),
+    }
+    if raw:
+        payload.update(extract_routing(message))
+
+    return payload
+
+
+def get_consumer_lag(redis: redis_sync.Redis, key: str) -> int:
+    """Get how many entries the slowest stream consumer is behind.
+
+    Consumer groups report their lag and pending count directly. The archiver
+    only checkpoints a stream id, its lag is estimated from the stream's time
+    span assuming a steady message rate.
+    """
+    try:
+        info = redis.xinfo_stream(key)
+        groups = redis.xinfo_groups(key)
+    except redis_sync.ResponseError:
+        return 0
+
+    length = info["length"]
+    if not length:
+        return 0
+
+    first_ms = stream_id_ms(info["first-entry"][0])
+    last_ms = stream_id_ms(info["last-entry"][0])
+
+    def estimate(position) -> int:
+        if last_ms == first_ms:
+            return 0
+        behind = (last_ms - stream_id_ms(position)) / (last_ms - first_ms)
+        return int(length * min(max(behind, 0.0), 1.0))
+
+    lags = []
+    for group in groups:
+        lag = group.get("lag")
+        if lag is None:
+            lag = estimate(group["last-delivered-id"])
+        lags.append(lag + group["pending"])
+
+    archived = redis.get(LAST_KEY)
+    if archived:
+        lags.append(estimate(archived))
+
+    return max(lags, default=0)
+
+
+class SpillQueue:
+    """Append-only overflow segments for messages Redis can't hold yet.
+
+    Draining a segment records how many of its messages went out in a
+    `.offset` file next to it, so a drain that fails part way resumes after
+    them instead of sending them again.
+    """
+
+    def __init__(
+        self, directory: str = SPILL_DIR, segment_size: int = SPILL_SEGMENT_SIZE
+    ):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.file = None
+        self.path: Optional[str] = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "*.spill")))
+
+    @property
+    def pending(self) -> bool:
+        return bool(self.file) or bool(self.segments())
+
+    def append(self, batch: List[Item]):
+        if not self.file or self.file.tell() >= self.segment_size:
+            self._rotate()
+
+        for payload, canvas_id in batch:
+            self.file.write(json.dumps([payload, canvas_id]) + "\n")
+        self.file.flush()
+
+    def pop(self) -> Tuple[Optional[str], int, List[Item]]:
+        """Oldest segment, how many of it were drained and the rest."""
+        segments = self.segments()
+        if not segments:
+            return None, 0, []
+
+        # Stop appending to the segment we're about to drain.
+        if segments[0] == self.path:
+            self._close()
+
+        with open(segments[0]) as f:
+            items = [tuple(json.loads(line)) for line in f if line.strip()]
+
+        try:
+            with open(segments[0] + ".offset") as f:
+                offset = int(f.read() or 0)
+        except FileNotFoundError:
+            offset = 0
+
+        return segments[0], offset, items[offset:]
+
+    def mark(self, path: str, offset: int):
+        # Atomic so a crash leaves either the old or the new offset.
+        with open(path + ".offset.tmp", "w") as f:
+            f.write(str(offset))
+        os.replace(path + ".offset.tmp", path + ".offset")
+
+    def remove(self, path: str):
+        os.remove(path)
+        try:
+            os.remove(path + ".offset")
+        except FileNotFoundError:
+            pass
+
+    def _rotate(self):
+        self._close()
+        self.path = os.path.join(self.directory, "%020d.spill" % time.time_ns())
+        self.file = open(self.path, "a")
+
+    def _close(self):
+        if self.file:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        self.file = None
+        self.path = None
+
+
+class FanoutBuffer:
+    """Gathers websocket messages and fans them out in pipelined batches.
+
+    Messages are buffered for up to `batch_delay` seconds or `batch_size`
+    messages, whichever comes first, then written to the stream and published
+    from a single worker thread so the event loop never blocks on Redis or the
+    Celery broker.
+
+    When the slowest stream consumer gets within `SPILL_HIGH` entries of the
+    trim length, new messages are spilled to disk instead of the stream and
+    drained back in order once consumers are under `SPILL_LOW` again.
+
+    A batch that fails to flush, e.g. while Redis is down, is spilled too and
+    flushing backs off, so an outage never stops ingest.
+    """
+
+    def __init__(
+        self,
+        key: str = socket_key,
+        batch_size: int = BATCH_SIZE,
+        batch_delay: float = BATCH_DELAY,
+        max_pending: int = MAX_PENDING,
+        celery_parse: bool = CELERY_PARSE,
+        spill_dir: str = SPILL_DIR,
+    ):
+        self.key = key
+        self.celery_parse = celery_parse
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+
+        # One thread keeps flushes ordered.
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.redis = get_redis()
+        self.spill = SpillQueue(spill_dir)
+        self.lag_checked = 0.0
+
+        self.stats = {
+            "received": 0,
+            "flushed": 0,
+            "batches": 0,
+            "blocked": 0,
+            "pending": 0,
+            "last_batch": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "lag": 0,
+            "spilling": 0,
+            "spilled": 0,
+            "drained": 0,
+            "failed_flushes": 0,
+        }
+
+    async def put(self, payload: dict, canvas_id: int):
+        # Count every time a producer has to wait on a full buffer.
+        if self.queue.full():
+            self.stats["blocked"] += 1
+
+        await self.queue.put((payload, canvas_id))
+        self.stats["received"] += 1
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        failures = 0
+
+        while True:
+            batch = await self._gather()
+
+            started = time.monotonic()
+            try:
+                await loop.run_in_executor(self.pool, self._flush, batch)
+                failures = 0
+            except Exception:
+                failures += 1
+                self.stats["failed_flushes"] += 1
+                log.exception("flushing %s messages failed, spilling", len(batch))
+                await loop.run_in_executor(self.pool, self._spill_failed, batch)
+                await asyncio.sleep(min(FLUSH_RETRY_MAX, 0.1 * 2**failures))
+
+                # Counted under spilled, not flushed.
+                for _ in batch:
+                    self.queue.task_done()
+                continue
+            flush_ms = (time.monotonic() - started) * 1000
+
+            if not batch:
+                continue
+
+            self.stats["flushed"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_batch"] = len(batch)
+            self.stats["last_flush_ms"] = round(flush_ms, 2)
+            self.stats["max_flush_ms"] = max(
+                self.stats["max_flush_ms"], self.stats["last_flush_ms"]
+            )
+
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _gather(self) -> List[Item]:
+        loop = asyncio.get_running_loop()
+
+        # Wait for the first message, then collect until the window closes.
+        # Idle windows still flush so spilled messages keep draining.
+        try:
+            batch = [await asyncio.wait_for(self.queue.get(), LAG_INTERVAL)]
+        except asyncio.TimeoutError:
+            return []
+        deadline = loop.time() + self.batch_delay
+
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    def _update_lag(self):
+        if time.monotonic() - self.lag_checked < LAG_INTERVAL:
+            return
+
+        self.stats["lag"] = get_consumer_lag(self.redis, self.key)
+        self.lag_checked = time.monotonic()
+
+    def _flush(self, batch: List[Item]):
+        self.stats["pending"] = self.queue.qsize()
+        self._update_lag()
+
+        # Drain older spilled messages first so the stream stays in order.
+        if self.spill.pending and self.stats["lag"] <= SPILL_LOW:
+            self._drain()
+
+        spilling = self.spill.pending or self.stats["lag"] >= SPILL_HIGH
+        if spilling and not self.stats["spilling"]:
+            log.warning("consumers %s entries behind, spilling", self.stats["lag"])
+        self.stats["spilling"] = int(spilling)
+
+        # Stream append and pubsub share one round trip.
+        pipe = self.redis.pipeline(transaction=False)
+        for payload, _ in batch:
+            if not spilling:
+                pipe.xadd(self.key, payload, maxlen=STREAM_MAXLEN, approximate=True)
+            pipe.publish(self.key, payload["message"])
+        pipe.hset(STATS_KEY, mapping=self.stats)
+
+        if spilling and batch:
+            self.spill.append(batch)
+            self.stats["spilled"] += len(batch)
+
+        try:
+            pipe.execute()
+        except redis_sync.RedisError:
+            # The batch is safe on disk, only the live publish is missed.
+            if not spilling:
+                raise
+            log.warning("publishing a spilled batch failed", exc_info=True)
+
+        if not spilling:
+            self._enqueue_parse(batch)
+
+    def _spill_failed(self, batch: List[Item]):
+        # A pipeline that failed part way may have added some of these, they
+        # are stored twice rather than lost.
+        if not batch:
+            return
+
+        try:
+            self.spill.append(batch)
+            self.stats["spilled"] += len(batch)
+        except OSError:
+            log.exception("spilling failed, lost %s messages", len(batch))
+
+    def _drain(self):
+        path, drained, items = self.spill.pop()
+        if not path:
+            return
+
+        for offset in range(0, len(items), self.batch_size):
+            chunk = items[offset : offset + self.batch_size]
+
+            pipe = self.redis.pipeline(transaction=False)
+            for payload, _ in chunk:
+                pipe.xadd(self.key, payload, maxlen=STREAM_MAXLEN, approximate=True)
+            pipe.execute()
+            self.spill.mark(path, drained + offset + len(chunk))
+
+            self._enqueue_parse(chunk)
+
+        self.spill.remove(path)
+        self.stats["drained"] += len(items)
+        log.info("drained %s spilled messages from %s", len(items), path)
+
+        # Draining adds lag, check again before the next segment.
+        self.lag_checked = 0.0
+
+    def _enqueue_parse(self, batch: List[Item]):
+        if not self.celery_parse or not batch:
+            return
+
+        # The messages are already in the stream, a broker outage only loses
+        # the parse tasks.
+        try:
+            self._publish_parse(batch)
+        except Exception:
+            log.exception("queueing %s parse tasks failed", len(batch))
+
+    @backoff.on_exception(
+        backoff.fibo,
+        Exception,
+        max_time=30,
+        on_backoff=handle_backoff,
+        on_giveup=handle_backoff,
+    )
+    def _publish_parse(self, batch: List[Item]):
+        # Reuse one broker connection for the whole batch.
+        with app.producer_or_acquire() as producer:
+            for payload, canvas_id in batch:
+                parse_message.apply_async(
+                    (payload["message"], canvas_id),
+                    producer=producer,
+                )
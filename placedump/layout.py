@@ -0,0 +1,43 @@
+import json
+from typing import Dict, List, Tuple
+
+from placedump.common import get_redis
+from placedump.palette import META_KEY
+
+# Where each board sits on the combined canvas, as in the 2022 config. Only
+# used until a config with canvasConfigurations is seen.
+BOARD_OFFSETS = {0: (0, 0), 1: (1000, 0), 2: (0, 1000), 3: (1000, 1000)}
+# The latest config's board offsets, a JSON object of index to [dx, dy].
+OFFSETS_FIELD = "offsets"
+
+Offsets = Dict[int, Tuple[int, int]]
+
+
+def offsets_from_config(canvases: List[dict]) -> Offsets:
+    # canvasConfigurations from a ConfigurationMessageData, in any order.
+    return {
+        int(canvas["index"]): (int(canvas["dx"]), int(canvas["dy"]))
+        for canvas in canvases
+    }
+
+
+def save_offsets(redis, offsets: Offsets):
+    # Returns the hset, async clients await it.
+    return redis.hset(
+        META_KEY,
+        OFFSETS_FIELD,
+        json.dumps({index: list(offset) for index, offset in offsets.items()}),
+    )
+
+
+def load_offsets(redis) -> Offsets:
+    offsets = redis.hget(META_KEY, OFFSETS_FIELD)
+    if not offsets:
+        return dict(BOARD_OFFSETS)
+
+    return {int(index): tuple(offset) for index, offset in json.loads(offsets).items()}
+
+
+def get_offsets() -> Offsets:
+    """The live config's board offsets, the 2022 layout until one is seen."""
+    return load_offsets(get_redis())
@@ -2,9 +2,11 @@ import os
 from contextlib import contextmanager
 from enum import Enum as PyEnum
 from enum import unique
+from functools import lru_cache
 from typing import Generator
 
 from cassandra.cluster import Cluster, Session
+from cassandra.query import PreparedStatement
 from cassandra.cqlengine import columns
 from cassandra.cqlengine.models import Model
 from sqlalchemy import (
@@ -40,6 +42,17 @@ def ctx_cass() -> Generator[Session, None, None]:
             session.shutdown()
 
 
+@lru_cache
+def get_cass() -> Session:
+    # Long lived session, created lazily so it is never shared across forks.
+    return cass_cluster.connect(keyspace="placeapp")
+
+
+@lru_cache
+def prepare_cass(query: str) -> PreparedStatement:
+    return get_cass().prepare(query)
+
+
 class CPixel(Model):
     __keyspace__ = "placeapp"
 
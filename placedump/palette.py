@@ -0,0 +1,193 @@
+import json
+import logging
+import time
+from io import BytesIO
+from typing import BinaryIO, List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+from placedump.common import get_redis
+
+log = logging.getLogger(__name__)
+
+# The 32 colour r/place 2022 palette, in config order.
+PALETTE_2022 = [
+    "#6D001A",
+    "#BE0039",
+    "#FF4500",
+    "#FFA800",
+    "#FFD635",
+    "#FFF8B8",
+    "#00A368",
+    "#00CC78",
+    "#7EED56",
+    "#00756F",
+    "#009EAA",
+    "#00CCC0",
+    "#2450A4",
+    "#3690EA",
+    "#51E9F4",
+    "#493AC1",
+    "#6A5CFF",
+    "#94B3FF",
+    "#811E9F",
+    "#B44AC0",
+    "#E4ABFF",
+    "#DE107F",
+    "#FF3881",
+    "#FF99AA",
+    "#6D482F",
+    "#9C6926",
+    "#FFB470",
+    "#000000",
+    "#515252",
+    "#898D90",
+    "#D4D7D9",
+    "#FFFFFF",
+]
+# Index for pixels nothing has been drawn on, or a diff doesn't change.
+TRANSPARENT = 255
+# The latest config's palette, a JSON list of hex by colour index.
+META_KEY = "place:meta"
+PALETTE_FIELD = "palette"
+# Long running processes pick up palette changes this often.
+REFRESH_INTERVAL = 60
+
+
+def parse_hex(colors: List[str]) -> np.ndarray:
+    return np.array(
+        [
+            [int(color.lstrip("#")[i : i + 2], 16) for i in (0, 2, 4)]
+            for color in colors
+        ],
+        dtype=np.uint8,
+    ).reshape(-1, 3)
+
+
+def pack_rgb(rgb: np.ndarray) -> np.ndarray:
+    rgb = rgb.astype(np.uint32)
+    return (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+
+
+class Palette:
+    """Converts between RGBA pixels and palette indexes.
+
+    `colors` is indexed by the config's colour index, missing indexes are
+    None. Indexed canvases are one uint8 per pixel with TRANSPARENT for
+    nothing drawn.
+    """
+
+    def __init__(self, colors: List[Optional[str]] = PALETTE_2022):
+        if len(colors) >= TRANSPARENT:
+            raise ValueError(f"palette too large: {len(colors)} colours")
+
+        self.colors = colors
+        indexes = np.array(
+            [index for index, color in enumerate(colors) if color], dtype=np.uint8
+        )
+        self.rgb = parse_hex([color for color in colors if color])
+
+        # RGBA for every index, anything not in the palette is transparent.
+        self.rgba = np.zeros((256, 4), dtype=np.uint8)
+        self.rgba[indexes, :3] = self.rgb
+        self.rgba[indexes, 3] = 255
+
+        packed = pack_rgb(self.rgb)
+        order = np.argsort(packed)
+        self.sorted = packed[order]
+        self.indexes = indexes[order]
+        self.rgb = self.rgb[order]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Palette) and self.colors == other.colors
+
+    def to_indexed(self, pixels: np.ndarray) -> np.ndarray:
+        """Map an (..., 4) RGBA array to (...) palette indexes."""
+        packed = pack_rgb(pixels[..., :3])
+        found = np.searchsorted(self.sorted, packed).clip(0, len(self.sorted) - 1)
+        indexed = self.indexes[found]
+
+        # Off-palette colours snap to the nearest entry.
+        missing = self.sorted[found] != packed
+        if missing.any():
+            distance = (
+                (pixels[missing][:, None, :3].astype(np.int32) - self.rgb) ** 2
+            ).sum(axis=2)
+            indexed[missing] = self.indexes[distance.argmin(axis=1)]
+
+        indexed[pixels[..., 3] == 0] = TRANSPARENT
+        return indexed
+
+    def to_rgba(self, indexed: np.ndarray) -> np.ndarray:
+        return self.rgba[indexed]
+
+    def index_image(self, img: Image.Image) -> np.ndarray:
+        """Decode an image straight to palette indexes.
+
+        Paletted PNGs map their own palette through a 256 entry lookup table
+        so the pixels are never expanded to RGBA.
+        """
+        if img.mode == "P":
+            rgba = np.zeros((256, 4), dtype=np.uint8)
+            rgba[:, 3] = 255
+            entries = np.array(img.getpalette("RGBA") or [], dtype=np.uint8)
+            rgba[: len(entries) // 4] = entries.reshape(-1, 4)
+
+            transparency = img.info.get("transparency")
+            if isinstance(transparency, bytes):
+                rgba[: len(transparency), 3] = np.frombuffer(transparency, np.uint8)
+            elif transparency is not None:
+                rgba[transparency, 3] = 0
+
+            return self.to_indexed(rgba)[np.asarray(img)]
+
+        if img.mode != "RGBA":
+            img = img.convert("RGBA")
+        return self.to_indexed(np.asarray(img))
+
+    def decode(self, data: Union[bytes, BinaryIO]) -> np.ndarray:
+        if isinstance(data, bytes):
+            data = BytesIO(data)
+        return self.index_image(Image.open(data))
+
+    def to_image(self, indexed: np.ndarray) -> Image.Image:
+        img = Image.fromarray(indexed, "P")
+        img.putpalette(self.rgba.tobytes(), "RGBA")
+        return img
+
+
+def colors_from_config(colors: List[dict]) -> List[Optional[str]]:
+    # colorPalette.colors from a ConfigurationMessageData, in any order.
+    by_index = {int(color["index"]): color["hex"] for color in colors}
+    return [by_index.get(index) for index in range(max(by_index, default=-1) + 1)]
+
+
+def save_palette(redis, colors: List[Optional[str]]):
+    # Returns the hset, async clients await it.
+    return redis.hset(META_KEY, PALETTE_FIELD, json.dumps(colors))
+
+
+def load_palette(redis) -> Palette:
+    colors = redis.hget(META_KEY, PALETTE_FIELD)
+    if not colors:
+        return Palette()
+
+    return Palette(json.loads(colors))
+
+
+_palette: Optional[Palette] = None
+_loaded = 0.0
+
+
+def get_palette() -> Palette:
+    """The live config's palette, the 2022 palette until one is seen."""
+    global _palette, _loaded
+
+    if _palette is None or time.monotonic() - _loaded > REFRESH_INTERVAL:
+        palette = load_palette(get_redis())
+        if _palette is not None and palette != _palette:
+            log.info("palette changed, now %s colours", len(palette.colors))
+        _palette, _loaded = palette, time.monotonic()
+
+    return _palette
@@ -0,0 +1,170 @@
+import json
+from typing import Iterable, List, Tuple
+
+import redis as redis_sync
+from redis import asyncio as aioredis
+
+# Pending pixels are one bit each in a per-board bitmap, plus a set of the
+# rows with anything pending so pops never scan a whole board.
+LEGACY_KEY = "queue:pixels"
+BITMAP_PREFIX = "queue:pixels:board:"
+ROWS_KEY = "queue:pixels:rows"
+COUNT_KEY = "queue:pixels:count"
+# Bits per row, a 2048x2048 board bitmap is 512KB.
+STRIDE = 2048
+PUSH_CHUNK = 10000
+
+Pixel = Tuple[int, int, int]
+
+# Bitmap keys are built in the scripts, fine on a single Redis but not Cluster.
+# ARGV: stride, bitmap prefix, then board, x, y for each pixel.
+PUSH_SCRIPT = """
+local stride = tonumber(ARGV[1])
+local added = 0
+
+for i = 3, #ARGV, 3 do
+    local board = ARGV[i]
+    local y = tonumber(ARGV[i + 2])
+    local offset = y * stride + tonumber(ARGV[i + 1])
+
+    if redis.call("SETBIT", ARGV[2] .. board, offset, 1) == 0 then
+        added = added + 1
+    end
+    redis.call("SADD", KEYS[1], board .. ":" .. y)
+end
+
+if added > 0 then
+    redis.call("INCRBY", KEYS[2], added)
+end
+return added
+"""
+
+# ARGV: count, stride, bitmap prefix. Returns board, x, y for each pixel.
+POP_SCRIPT = """
+local want = tonumber(ARGV[1])
+local stride = tonumber(ARGV[2])
+local row_bytes = stride / 8
+local result = {}
+local popped = 0
+
+while popped < want do
+    local row = redis.call("SRANDMEMBER", KEYS[1])
+    if not row then
+        break
+    end
+
+    local sep = string.find(row, ":")
+    local board = string.sub(row, 1, sep - 1)
+    local y = tonumber(string.sub(row, sep + 1))
+    local key = ARGV[3] .. board
+    local first = y * row_bytes
+    local last = first + row_bytes - 1
+
+    while popped < want do
+        local pos = redis.call("BITPOS", key, 1, first, last)
+        if pos < 0 then
+            break
+        end
+
+        redis.call("SETBIT", key, pos, 0)
+        table.insert(result, tonumber(board))
+        table.insert(result, pos - y * stride)
+        table.insert(result, y)
+        popped = popped + 1
+    end
+
+    if redis.call("BITPOS", key, 1, first, last) < 0 then
+        redis.call("SREM", KEYS[1], row)
+    end
+end
+
+if popped > 0 then
+    redis.call("DECRBY", KEYS[2], popped)
+end
+return result
+"""
+
+
+def encode(board: int, x: int, y: int) -> List[int]:
+    board, x, y = int(board), int(x), int(y)
+    if not 0 <= x < STRIDE or not 0 <= y < STRIDE or board < 0:
+        raise ValueError(f"pixel out of range: {board} {x} {y}")
+
+    return [board, x, y]
+
+
+def decode(flat: List[int]) -> List[Pixel]:
+    return [
+        (int(flat[i]), int(flat[i + 1]), int(flat[i + 2]))
+        for i in range(0, len(flat), 3)
+    ]
+
+
+def decode_legacy(member: str) -> Pixel:
+    # Old JSON members, some producers stored the numbers as strings.
+    pixel = json.loads(member)
+    return int(pixel["board"]), int(pixel["x"]), int(pixel["y"])
+
+
+def _push_args(pixels: List[Pixel]) -> list:
+    args = [STRIDE, BITMAP_PREFIX]
+    for pixel in pixels:
+        args.extend(encode(*pixel))
+
+    return args
+
+
+def push(redis: redis_sync.Redis, pixels: Iterable[Pixel]) -> int:
+    """Queue pixels, returns how many were not already pending."""
+    pixels = list(pixels)
+    script = redis.register_script(PUSH_SCRIPT)
+    added = 0
+
+    for offset in range(0, len(pixels), PUSH_CHUNK):
+        chunk = pixels[offset : offset + PUSH_CHUNK]
+        added += script(keys=[ROWS_KEY, COUNT_KEY], args=_push_args(chunk))
+
+    return added
+
+
+def pop(redis: redis_sync.Redis, count: int) -> List[Pixel]:
+    script = redis.register_script(POP_SCRIPT)
+    return decode(
+        script(keys=[ROWS_KEY, COUNT_KEY], args=[count, STRIDE, BITMAP_PREFIX])
+    )
+
+
+async def apush(redis: aioredis.Redis, pixels: Iterable[Pixel]) -> int:
+    pixels = list(pixels)
+    script = redis.register_script(PUSH_SCRIPT)
+    added = 0
+
+    for offset in range(0, len(pixels), PUSH_CHUNK):
+        chunk = pixels[offset : offset + PUSH_CHUNK]
+        added += await script(keys=[ROWS_KEY, COUNT_KEY], args=_push_args(chunk))
+
+    return added
+
+
+async def apop(redis: aioredis.Redis, count: int) -> List[Pixel]:
+    script = redis.register_script(POP_SCRIPT)
+    return decode(
+        await script(keys=[ROWS_KEY, COUNT_KEY], args=[count, STRIDE, BITMAP_PREFIX])
+    )
+
+
+async def apending(redis: aioredis.Redis) -> int:
+    return int(await redis.get(COUNT_KEY) or 0)
+
+
+async def adrain_legacy(redis: aioredis.Redis, batch: int = PUSH_CHUNK) -> int:
+    """Move pixels from the old JSON set into the bitmaps."""
+    moved = 0
+
+    while True:
+        members = await redis.spop(LEGACY_KEY, batch)
+        if not members:
+            return moved
+
+        moved += len(members)
+        await apush(redis, [decode_legacy(member) for member in members])
@@ -0,0 +1,167 @@
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Generator, Optional
+
+from b2sdk.exception import ServiceError, TooManyRequests
+
+from placedump.common import get_redis
+
+log = logging.getLogger(__name__)
+
+INITIAL_LIMIT = float(os.environ.get("B2_LIMIT_INITIAL", "16"))
+MIN_LIMIT = float(os.environ.get("B2_LIMIT_MIN", "1"))
+MAX_LIMIT = float(os.environ.get("B2_LIMIT_MAX", "256"))
+DECREASE_FACTOR = 0.5
+# Overload fails many operations at once, only cut once per window.
+DECREASE_COOLDOWN_MS = 2000
+# Slots held by dead workers are freed after this long.
+LEASE_MS = 120000
+POLL_INTERVAL = 0.05
+
+THROTTLE_ERRORS = (TooManyRequests, ServiceError)
+
+# KEYS: inflight zset, state hash. ARGV: token, now ms, lease ms, initial.
+# Returns 0 with a slot, ms to wait while backing off or -1 when full.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[2])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now)
+
+local state = redis.call("HMGET", KEYS[2], "limit", "blocked_until")
+local limit = tonumber(state[1]) or tonumber(ARGV[4])
+local blocked_until = tonumber(state[2]) or 0
+
+if blocked_until > now then
+    return blocked_until - now
+end
+
+if redis.call("ZCARD", KEYS[1]) < math.max(math.floor(limit), 1) then
+    redis.call("ZADD", KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+    return 0
+end
+
+return -1
+"""
+
+# KEYS: inflight zset, state hash. ARGV: token, now ms, outcome, retry after
+# ms, initial, min, max, decrease factor, cooldown ms. Returns the new limit.
+RELEASE_SCRIPT = """
+local now = tonumber(ARGV[2])
+redis.call("ZREM", KEYS[1], ARGV[1])
+
+local state = redis.call("HMGET", KEYS[2], "limit", "cut_at", "blocked_until")
+local limit = tonumber(state[1]) or tonumber(ARGV[5])
+
+if ARGV[3] == "ok" then
+    limit = math.min(tonumber(ARGV[7]), limit + 1 / limit)
+elseif ARGV[3] == "throttled" then
+    local cut_at = tonumber(state[2]) or 0
+    if now - cut_at >= tonumber(ARGV[9]) then
+        limit = math.max(tonumber(ARGV[6]), limit * tonumber(ARGV[8]))
+        redis.call("HSET", KEYS[2], "cut_at", now)
+    end
+
+    local blocked_until = now + tonumber(ARGV[4])
+    if blocked_until > (tonumber(state[3]) or 0) then
+        redis.call("HSET", KEYS[2], "blocked_until", blocked_until)
+    end
+end
+
+redis.call("HSET", KEYS[2], "limit", limit)
+return tostring(limit)
+"""
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class AdaptiveLimiter:
+    """Cluster-wide AIMD concurrency limit for one class of B2 operations.
+
+    Every worker takes a slot from a shared Redis zset before calling B2.
+    Successes grow the limit by 1/limit, so about one slot per round of
+    successful operations. Throttling (429/5xx) halves it once per cooldown
+    window and pauses everyone for the server's retry-after hint. Other
+    errors leave the limit alone.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: float = INITIAL_LIMIT,
+        minimum: float = MIN_LIMIT,
+        maximum: float = MAX_LIMIT,
+    ):
+        self.inflight_key = f"b2:inflight:{name}"
+        self.state_key = f"b2:limit:{name}"
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+
+        self.redis = get_redis()
+        self.acquire_script = self.redis.register_script(ACQUIRE_SCRIPT)
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT)
+
+    def acquire(self, token: str):
+        while True:
+            wait = self.acquire_script(
+                keys=[self.inflight_key, self.state_key],
+                args=[token, now_ms(), LEASE_MS, self.initial],
+            )
+            if wait == 0:
+                return
+
+            # Jitter so waiting workers don't all retry in lockstep.
+            delay = wait / 1000 if wait > 0 else POLL_INTERVAL
+            time.sleep(delay * random.uniform(1.0, 1.5))
+
+    def release(self, token: str, outcome: str, retry_after: Optional[float] = None):
+        limit = self.release_script(
+            keys=[self.inflight_key, self.state_key],
+            args=[
+                token,
+                now_ms(),
+                outcome,
+                int((retry_after or 0) * 1000),
+                self.initial,
+                self.minimum,
+                self.maximum,
+                DECREASE_FACTOR,
+                DECREASE_COOLDOWN_MS,
+            ],
+        )
+
+        if outcome == "throttled":
+            log.warning(
+                "%s throttled, limit now %s, retry after %s",
+                self.state_key,
+                limit,
+                retry_after,
+            )
+
+    @contextmanager
+    def slot(self) -> Generator[None, None, None]:
+        token = uuid.uuid4().hex
+        self.acquire(token)
+
+        try:
+            yield
+        except THROTTLE_ERRORS as e:
+            self.release(token, "throttled", getattr(e, "retry_after_seconds", None))
+            raise
+        except Exception:
+            self.release(token, "error")
+            raise
+
+        self.release(token, "ok")
+
+
+@lru_cache
+def get_limiter(name: str) -> AdaptiveLimiter:
+    # B2 limits uploads and downloads separately.
+    return AdaptiveLimiter(name)
@@ -0,0 +1,171 @@
+import bisect
+import glob
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import zstandard
+
+from placedump.archive import ARCHIVE_DIR
+from placedump.canvas import BoardState, Frame, Reconstructor, iter_frames
+from placedump.ratelimit import get_limiter
+from placedump.storage import get_bucket
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "snapshots")
+# Keyframe each board every this many ms of canvas time or diffs.
+SNAPSHOT_INTERVAL_MS = int(os.environ.get("SNAPSHOT_INTERVAL_MS", "600000"))
+SNAPSHOT_EVERY_DIFFS = int(os.environ.get("SNAPSHOT_EVERY_DIFFS", "2000"))
+SNAPSHOT_UPLOAD = os.environ.get("SNAPSHOT_UPLOAD", "0") == "1"
+SNAPSHOT_PREFIX = "snapshots/"
+# Stream ids are assigned after the frame's own timestamp, read a bit wider.
+ARCHIVE_MARGIN_MS = 60000
+COMPRESSION_LEVEL = 10
+
+
+class SnapshotStore:
+    """Per-board keyframes of the canvas, indexed by timestamp.
+
+    Each keyframe is a board's palette-indexed pixels saved as `.npy` so any
+    number of readers can memory map one copy, plus a zstd compressed
+    `.npy.zst` kept alongside and optionally uploaded to B2. A board's
+    keyframes live in `{directory}/{board}/{timestamp}.npy`, the file names
+    are the index.
+    """
+
+    def __init__(
+        self,
+        directory: str = SNAPSHOT_DIR,
+        upload: bool = SNAPSHOT_UPLOAD,
+        interval_ms: int = SNAPSHOT_INTERVAL_MS,
+        every_diffs: int = SNAPSHOT_EVERY_DIFFS,
+    ):
+        self.directory = directory
+        self.upload = upload
+        self.interval_ms = interval_ms
+        self.every_diffs = every_diffs
+
+        self.index: Dict[int, List[int]] = {}
+        # Per board: timestamp of the last keyframe, diffs since.
+        self.progress: Dict[int, Tuple[float, int]] = {}
+
+    def path(self, board: int, timestamp: int) -> str:
+        return os.path.join(self.directory, str(board), f"{timestamp}.npy")
+
+    def timestamps(self, board: int) -> List[int]:
+        if board not in self.index:
+            names = glob.glob(os.path.join(self.directory, str(board), "*.npy*"))
+            self.index[board] = sorted(
+                {int(os.path.basename(name).split(".", 1)[0]) for name in names}
+            )
+
+        return self.index[board]
+
+    def nearest(self, board: int, at: float) -> Optional[int]:
+        timestamps = self.timestamps(board)
+        position = bisect.bisect_right(timestamps, at)
+        return timestamps[position - 1] if position else None
+
+    def write(self, board: int, state: BoardState) -> str:
+        timestamp = int(state.timestamp)
+        path = self.path(board, timestamp)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, state.pixels)
+        with open(path + ".tmp", "rb") as f:
+            raw = f.read()
+        os.replace(path + ".tmp", path)
+
+        compressed = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(raw)
+        with open(path + ".zst.tmp", "wb") as f:
+            f.write(compressed)
+        os.replace(path + ".zst.tmp", path + ".zst")
+
+        if self.upload:
+            with get_limiter("upload").slot():
+                get_bucket().upload_bytes(
+                    compressed, f"{SNAPSHOT_PREFIX}{board}/{timestamp}.npy.zst"
+                )
+
+        timestamps = self.timestamps(board)
+        if timestamp not in timestamps:
+            bisect.insort(timestamps, timestamp)
+
+        log.info("board %s keyframe at %s, %s bytes", board, timestamp, len(compressed))
+        return path
+
+    def load(self, board: int, timestamp: int) -> np.ndarray:
+        """Memory map a keyframe, unpacking it from `.zst` if needed."""
+        path = self.path(board, timestamp)
+
+        if not os.path.exists(path):
+            with open(path + ".zst", "rb") as f:
+                raw = zstandard.ZstdDecompressor().decompress(f.read())
+            with open(path + ".tmp", "wb") as f:
+                f.write(raw)
+            os.replace(path + ".tmp", path)
+
+        return np.load(path, mmap_mode="r")
+
+    def load_state(self, board: int, at: float) -> Optional[BoardState]:
+        timestamp = self.nearest(board, at)
+        if timestamp is None:
+            return None
+
+        # Copied out of the map, the board is drawn on from here.
+        indexed = self.load(board, timestamp)
+        state = BoardState(indexed.shape[1], indexed.shape[0])
+        np.copyto(state.pixels, indexed)
+        state.timestamp = float(timestamp)
+        return state
+
+    def observe(self, frame: Frame, state: BoardState):
+        """Write a keyframe once a board is due, call after every frame."""
+        last, diffs = self.progress.get(frame.board, (None, 0))
+        diffs += 1
+
+        due = (
+            last is None
+            or state.timestamp - last >= self.interval_ms
+            or diffs >= self.every_diffs
+        )
+        if due:
+            self.write(frame.board, state)
+            last, diffs = state.timestamp, 0
+
+        self.progress[frame.board] = (last, diffs)
+
+
+def build(store: SnapshotStore, frames: Iterable[Frame], reconstructor: Reconstructor):
+    for frame, state in reconstructor.replay(frames):
+        store.observe(frame, state)
+
+
+def board_at(
+    board: int,
+    at: float,
+    store: SnapshotStore,
+    since_ms: int = 24 * 60 * 60 * 1000,
+    reconstructor: Optional[Reconstructor] = None,
+    directory: str = ARCHIVE_DIR,
+) -> Optional[BoardState]:
+    """Rebuild a board from its nearest keyframe and the diffs after it.
+
+    Without a keyframe, falls back to a full rebuild from `since_ms` before.
+    """
+    reconstructor = reconstructor or Reconstructor()
+
+    state = store.load_state(board, at)
+    if state:
+        reconstructor.seed(board, state)
+        start = state.timestamp - ARCHIVE_MARGIN_MS
+    else:
+        start = at - since_ms
+
+    frames = iter_frames(
+        int(start), int(at + ARCHIVE_MARGIN_MS), canvas=board, directory=directory
+    )
+    return reconstructor.reconstruct(frames, at).get(board)
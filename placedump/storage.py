@@ -0,0 +1,236 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from functools import lru_cache
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+import redis as redis_sync
+from cassandra.concurrent import execute_concurrent_with_args
+
+from placedump.common import get_b2_api, get_redis
+from placedump.model import get_cass, prepare_cass
+from placedump.ratelimit import get_limiter
+
+log = logging.getLogger(__name__)
+
+BUCKET_NAME = "erin-reddit-afd2022"
+BLOB_PREFIX = "blobs/"
+# Hashes of every blob known to be in the bucket.
+BLOBS_KEY = "blobs:known"
+
+# Small blobs can be appended into shared pack objects instead.
+PACK_PREFIX = "packs/"
+PACK_SIZE = int(os.environ.get("STORAGE_PACK_SIZE", str(1024 * 1024 * 16)))
+PACK_MAX_AGE = float(os.environ.get("STORAGE_PACK_MAX_AGE", "5.0"))
+PACK_MAX_BLOB = int(os.environ.get("STORAGE_PACK_MAX_BLOB", str(1024 * 256)))
+
+
+@lru_cache
+def get_bucket(name: str = BUCKET_NAME):
+    b2 = get_b2_api()
+    return b2.get_bucket_by_name(name)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_name(digest: str) -> str:
+    return f"{BLOB_PREFIX}{digest}.png"
+
+
+def legacy_name(url: str) -> str:
+    # Frames stored before content addressing live under their URL path.
+    return url.replace("https://", "")
+
+
+def store_blob(redis: redis_sync.Redis, data: bytes) -> Tuple[str, bool]:
+    """Store a frame by content hash, uploading it only if it is new.
+
+    Returns the hash and whether this call uploaded it. Two workers racing on
+    the same new blob may both upload, B2 keeps the identical bytes as an
+    extra version which is harmless.
+    """
+    digest = content_hash(data)
+
+    if redis.sismember(BLOBS_KEY, digest):
+        return digest, False
+
+    with get_limiter("upload").slot():
+        get_bucket().upload_bytes(data, blob_name(digest))
+    # Only mark the hash known once the upload has landed.
+    return digest, bool(redis.sadd(BLOBS_KEY, digest))
+
+
+def get_manifest(url: str) -> Optional[str]:
+    row = (
+        get_cass()
+        .execute(prepare_cass("SELECT hash FROM urls WHERE url = ?"), (url,))
+        .one()
+    )
+    return row.hash if row else None
+
+
+def download_bytes(name: str, range_: Optional[Tuple[int, int]] = None) -> bytes:
+    f_data = BytesIO()
+    with get_limiter("download").slot():
+        get_bucket().download_file_by_name(name, range_=range_).save(f_data)
+    return f_data.getvalue()
+
+
+def get_pack_entry(digest: str) -> Optional[Tuple[str, int, int]]:
+    row = (
+        get_cass()
+        .execute(
+            prepare_cass(
+                "SELECT pack, pack_offset, pack_length FROM blobs WHERE hash = ?"
+            ),
+            (digest,),
+        )
+        .one()
+    )
+    return (row.pack, row.pack_offset, row.pack_length) if row else None
+
+
+def read_blob(digest: str) -> bytes:
+    """Read a blob by hash, from its pack with a ranged read if it was packed."""
+    entry = get_pack_entry(digest)
+    if not entry:
+        return download_bytes(blob_name(digest))
+
+    pack, offset, length = entry
+    # B2 ranges are inclusive.
+    return download_bytes(pack, range_=(offset, offset + length - 1))
+
+
+def not_new(future: Future) -> Future:
+    """Follows a pending store's future, resolving with is_new False."""
+    result = Future()
+
+    def done(stored: Future):
+        if stored.exception():
+            result.set_exception(stored.exception())
+        else:
+            result.set_result((stored.result()[0], False))
+
+    future.add_done_callback(done)
+    return result
+
+
+class PackWriter:
+    """Appends small blobs into rolling pack objects, one upload per pack.
+
+    `store` returns a future resolving to `(digest, is_new)` once the blob
+    is durable, so callers only record the frame after its pack is in B2
+    and indexed in the `blobs` table. Packs are uploaded once they reach
+    `max_size` bytes, are `max_age` seconds old or on `flush()`. Blobs over
+    `PACK_MAX_BLOB` are stored as loose objects instead.
+    """
+
+    def __init__(self, max_size: int = PACK_SIZE, max_age: float = PACK_MAX_AGE):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.redis = get_redis()
+
+        self.lock = threading.Lock()
+        # Held for the whole upload so packs are written one at a time.
+        self.flush_lock = threading.Lock()
+        self.buffer = bytearray()
+        self.entries: Dict[str, Tuple[int, int, Future]] = {}
+        self.started = 0.0
+        self.thread = None
+
+    def store(self, data: bytes) -> Future:
+        digest = content_hash(data)
+
+        if len(data) > PACK_MAX_BLOB or self.redis.sismember(BLOBS_KEY, digest):
+            future = Future()
+            future.set_result(store_blob(self.redis, data))
+            return future
+
+        with self.lock:
+            # The same frame twice in one pack is stored once, only the
+            # first store reports it new.
+            if digest in self.entries:
+                return not_new(self.entries[digest][2])
+
+            if not self.entries:
+                self.started = time.monotonic()
+
+            future = Future()
+            self.entries[digest] = (len(self.buffer), len(data), future)
+            self.buffer.extend(data)
+            full = len(self.buffer) >= self.max_size
+
+            if not self.thread:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+        if full:
+            self.flush()
+
+        return future
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                buffer, self.buffer = self.buffer, bytearray()
+                entries, self.entries = self.entries, {}
+
+            if not entries:
+                return
+
+            try:
+                results = self._upload(bytes(buffer), entries)
+            except Exception as e:
+                log.exception("failed uploading pack of %s blobs", len(entries))
+                for _, _, future in entries.values():
+                    future.set_exception(e)
+                return
+
+            for digest, is_new in results:
+                entries[digest][2].set_result((digest, is_new))
+
+    def _upload(
+        self, data: bytes, entries: Dict[str, Tuple[int, int, Future]]
+    ) -> List[Tuple[str, bool]]:
+        name = f"{PACK_PREFIX}{time.time_ns()}-{uuid.uuid4().hex[:8]}.pack"
+        with get_limiter("upload").slot():
+            get_bucket().upload_bytes(data, name)
+
+        execute_concurrent_with_args(
+            get_cass(),
+            prepare_cass("""
+                INSERT INTO blobs (hash, pack, pack_offset, pack_length)
+                VALUES (?, ?, ?, ?)
+                """),
+            [
+                (digest, name, offset, length)
+                for digest, (offset, length, _) in entries.items()
+            ],
+            concurrency=64,
+            raise_on_first_error=True,
+        )
+
+        # Only mark hashes known once the pack and its index have landed.
+        pipe = self.redis.pipeline(transaction=False)
+        for digest in entries:
+            pipe.sadd(BLOBS_KEY, digest)
+        added = pipe.execute()
+
+        log.info(f"{name}, {len(entries)} blobs, {len(data)} bytes.")
+        return [(digest, bool(new)) for digest, new in zip(entries, added)]
+
+    def _run(self):
+        while True:
+            time.sleep(self.max_age / 4)
+            with self.lock:
+                due = self.entries and time.monotonic() - self.started >= self.max_age
+
+            if due:
+                self.flush()
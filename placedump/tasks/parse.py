@@ -1,8 +1,90 @@
 import json
+from typing import List, Optional, Union
 
 from placedump.common import ctx_redis
+from placedump.layout import Offsets, offsets_from_config, save_offsets
+from placedump.palette import colors_from_config, save_palette
 from placedump.tasks import app
 from placedump.tasks.pixels import download_url
+from placedump.urls import filter_unseen
+
+
+def get_canvas_id(payload: dict, canvas_id: int = None) -> int:
+    # Fall back to the canvas ID the ingest service attached to the message.
+    if canvas_id is None:
+        canvas_id = payload.get("canvas_id")
+
+    # Get canvas ID from subscription number. Board 0 is a valid ID.
+    if canvas_id is None or canvas_id == "":
+        canvas_id = max(
+            int(payload.get("id", 2)) - 2,  # Default to root board if we have no ID.
+            0,  # Default to first board if we something invalid.
+        )
+
+    return canvas_id
+
+
+def get_stream_canvas_id(fields: dict) -> Optional[Union[int, str]]:
+    # Raw frames carry the canvas ID as a separate stream field.
+    canvas_id = fields.get("canvas_id")
+    if canvas_id is not None and canvas_id.isdigit():
+        return int(canvas_id)
+
+    return canvas_id
+
+
+def get_data(payload: dict) -> dict:
+    # Decoded subscription results and raw graphql-ws frames nest differently.
+    try:
+        return payload["subscribe"]["data"] or {}
+    except KeyError:
+        try:
+            return payload["payload"]["data"]["subscribe"]["data"] or {}
+        except KeyError:
+            return {}
+
+
+def get_highest_index(payload: dict) -> Optional[int]:
+    data = get_data(payload)
+
+    try:
+        if data.get("__typename") == "ConfigurationMessageData":
+            highest_index = 0
+            for canvas in data["canvasConfigurations"]:
+                highest_index = max(canvas["index"], highest_index)
+            return highest_index
+    except KeyError:
+        pass
+
+    return None
+
+
+def get_palette_colors(payload: dict) -> Optional[List[Optional[str]]]:
+    data = get_data(payload)
+
+    try:
+        if data.get("__typename") == "ConfigurationMessageData":
+            return colors_from_config(data["colorPalette"]["colors"]) or None
+    except (KeyError, TypeError):
+        pass
+
+    return None
+
+
+def get_canvas_offsets(payload: dict) -> Optional[Offsets]:
+    data = get_data(payload)
+
+    try:
+        if data.get("__typename") == "ConfigurationMessageData":
+            return offsets_from_config(data["canvasConfigurations"]) or None
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    return None
+
+
+def get_url(payload: dict) -> Optional[str]:
+    return get_data(payload).get("name")
 
 
 @app.task(
@@ -15,33 +97,28 @@ def parse_message(message: str, canvas_id: int = None):
     except json.JSONDecodeError:
         return
 
-    # Get canvas ID from subscription number.
-    if not canvas_id:
-        canvas_id = min(
-            int(payload.get("id", 2)) - 2,  # Default to root board if we have no ID.
-            0,  # Default to first board if we something invalid.
-        )
+    canvas_id = get_canvas_id(payload, canvas_id)
 
     # Attempt to handle based on message type.
-    with ctx_redis() as redis:
-        try:
-            message_type = payload["subscribe"]["data"]["__typename"]
+    highest_index = get_highest_index(payload)
+    if highest_index is not None:
+        with ctx_redis() as redis:
+            redis.hset("place:meta", "index", highest_index)
 
-            if message_type == "ConfigurationMessageData":
-                highest_index = 0
-                for canvas in payload["subscribe"]["data"]["canvasConfigurations"]:
-                    highest_index = max(canvas["index"], highest_index)
-                redis.hset("place:meta", "index", highest_index)
-        except KeyError:
-            pass
+    colors = get_palette_colors(payload)
+    if colors:
+        with ctx_redis() as redis:
+            save_palette(redis, colors)
 
-    try:
-        url = payload["subscribe"]["data"]["name"]
-    except KeyError:
-        try:
-            url = payload["payload"]["data"]["subscribe"]["data"]["name"]
-        except KeyError:
-            print(payload)
-            return
+    offsets = get_canvas_offsets(payload)
+    if offsets:
+        with ctx_redis() as redis:
+            save_offsets(redis, offsets)
+
+    url = get_url(payload)
+    if not url:
+        print(payload)
+        return
 
-    download_url.delay(canvas_id, url)
+    if filter_unseen([url]):
+        download_url.delay(canvas_id, url)
@@ -1,29 +1,38 @@
 import datetime
-import json
 import logging
 import os.path
-from functools import lru_cache
 from io import BytesIO
+from typing import Union
 
 import httpx
 import numpy as np
 import sentry_sdk
 from async_timeout import timeout
-from b2sdk.exception import TooManyRequests
 from cassandra.cqlengine.query import BatchQuery, BatchType
+from celery.signals import worker_process_shutdown
 from gql import gql
 from PIL import Image
-from pottery import Redlock
 
-from placedump.common import ctx_redis, get_b2_api, get_gql_client, get_redis
+from placedump import framecache, framediff, pixelqueue
+from placedump.common import ctx_redis, get_gql_client, get_redis
 from placedump.model import CPixel, ctx_cass
+from placedump.storage import store_blob
 from placedump.tasks import app
+from placedump.urls import (
+    BUSY,
+    CLAIM_LEASE_MS,
+    CLAIMED,
+    claim_url,
+    get_url_writer,
+    new_token,
+    release_url,
+)
 
 log = logging.getLogger(__name__)
-CONTRACT_DOWNLOAD_LOCK = 60
+# Busy URLs are looked at again once the holder's lease could have run out.
+BUSY_RETRY = CLAIM_LEASE_MS / 1000
 
-query_get_pixel = gql(
-    """
+query_get_pixel = gql("""
   mutation pixelHistory($input: ActInput!) {
     act(input: $input) {
       data {
@@ -42,8 +51,7 @@ query_get_pixel = gql(
       }
     }
   }
- """
-)
+ """)
 
 
 def fetch_http(url: str) -> bytes:
@@ -54,45 +62,77 @@ def fetch_http(url: str) -> bytes:
     return content
 
 
-@app.task()
-def get_non_transparent(board, content: bytes):
-    # https://stackoverflow.com/questions/60051941/find-the-coordinates-in-an-image-where-a-specified-colour-is-detected
-    f_data = BytesIO(content)
+def get_alpha_mask(img: Image.Image) -> np.ndarray:
+    # Only alpha matters, skip the full RGBA conversion where we can.
+    if img.mode == "P":
+        # Paletted frames carry alpha per palette index, either in the
+        # palette itself or in the PNG's tRNS chunk.
+        alpha = np.full(256, 255, dtype=np.uint8)
+        palette_alpha = (img.getpalette("RGBA") or [])[3::4]
+        alpha[: len(palette_alpha)] = palette_alpha
+        transparency = img.info.get("transparency")
+        if isinstance(transparency, bytes):
+            alpha[: len(transparency)] = np.frombuffer(transparency, dtype=np.uint8)
+        elif transparency is not None:
+            alpha[transparency] = 0
 
-    # parse
-    img = Image.open(f_data).convert("RGBA")
-    np_img = np.array(img)
+        return alpha[np.asarray(img)] > 0
 
-    Y, X = np.where(np.all(np_img != (0, 0, 0, 0), axis=2))
+    if img.mode in ("RGBA", "LA", "PA"):
+        return np.asarray(img.getchannel("A")) > 0
 
-    changed = list(np.column_stack((X, Y)))
-    if len(changed) > 8192:
+    return np.asarray(img.convert("RGBA").getchannel("A")) > 0
+
+
+@app.task(
+    autoretry_for=(Exception,),
+    retry_backoff=2,
+    max_retries=10,
+)
+def get_non_transparent(board, frame: Union[str, bytes]):
+    # Frames are passed by hash, tasks queued before that carry the bytes.
+    if isinstance(frame, str):
+        with framecache.get_cache().open_frame(frame) as f_data:
+            mask = get_alpha_mask(Image.open(f_data))
+    else:
+        mask = get_alpha_mask(Image.open(BytesIO(frame)))
+
+    Y, X = np.nonzero(mask)
+    # Full frames go through diff_full_frame, anything this big is one.
+    if len(X) > 8192:
         return []
+    changed = list(zip(X.tolist(), Y.tolist()))
 
-    # queue all pixels
-    with ctx_redis() as redis:
-        for cords in changed:
-            x, y = cords
-            x = int(x)
-            y = int(y)
-            redis.sadd(
-                "queue:pixels",
-                json.dumps(
-                    {
-                        "x": x,
-                        "y": y,
-                        "board": board,
-                    }
-                ),
-            )
+    # queue all pixels in one round trip
+    if changed:
+        with ctx_redis() as redis:
+            pixelqueue.push(redis, [(board, x, y) for x, y in changed])
 
     return changed
 
 
-@lru_cache
-def get_bucket(name: str):
-    b2 = get_b2_api()
-    return b2.get_bucket_by_name(name)
+@app.task()
+def diff_full_frame(board: int, timestamp: int, digest: str) -> int:
+    # Full frames are the whole canvas, queue only what changed since the last.
+    with ctx_redis() as redis:
+        return len(framediff.diff_full_frame(redis, board, timestamp, digest))
+
+
+def queue_frame(board: int, url: str, digest: str, is_new: bool):
+    """Queue a stored frame's pixels for parsing."""
+    parsed = framediff.parse_frame_url(url)
+    if parsed and parsed[2]:
+        # Diffed even if the blob is known, the board's reference may have moved.
+        diff_full_frame.delay(board, parsed[0], digest)
+    elif is_new:
+        # Known diff frames were already parsed.
+        get_non_transparent.delay(board, digest)
+
+
+def retry_busy(board: int, url: str):
+    # The holder may die without releasing, e.g. OOM killed, so come back
+    # once its lease is up. A finished download is DONE by then.
+    download_url.apply_async((board, url), countdown=BUSY_RETRY)
 
 
 @app.task(
@@ -101,35 +141,40 @@ def get_bucket(name: str):
     max_retries=10,
 )
 def download_url(board: int, url: str):
-    bucket = get_bucket("erin-reddit-afd2022")
+    token = new_token()
 
     with ctx_redis() as redis:
-        upload_lock = Redlock(
-            key=f"download:{url}", masters={redis}, auto_release_time=60
-        )
-
-        # Upload the file one worker at a time.
-        with upload_lock:
+        state = claim_url(redis, url, token)
+        if state == BUSY:
+            log.debug(f"{url} is busy, retrying in {BUSY_RETRY}s.")
+            retry_busy(board, url)
+            return
+        if state != CLAIMED:
+            log.debug(f"{url} is {state}, skipping.")
+            return
+
+        try:
             data = fetch_http(url)
-            filename = url.replace("https://", "")
-            log.info(f"{url}, {len(data)} bytes.")
 
-            # Upload to B2.
-            bucket.upload_bytes(data, filename)
+            # Upload to B2, identical frames are only stored once.
+            digest, is_new = store_blob(redis, data)
+            log.info(f"{url}, {len(data)} bytes, {digest}, new: {is_new}.")
 
             # Kick off the image parsing loop.
-            get_non_transparent.delay(board, data)
-
-            # Save URL to DB.
-            with ctx_cass() as db:
-                db.execute(
-                    """
-                    INSERT INTO urls (url, fetched, size)
-                    VALUES (%s, %s, %s)
-                    IF NOT EXISTS
-                    """,
-                    (url, datetime.datetime.utcnow(), len(data)),
-                )
+            if is_new:
+                framecache.get_cache().put(digest, data)
+            queue_frame(board, url, digest, is_new)
+        except Exception:
+            release_url(redis, url, token)
+            raise
+
+    # Save URL to DB, the claim is marked done once the row is written.
+    get_url_writer().add(url, len(data), digest)
+
+
+@worker_process_shutdown.connect
+def flush_url_writer(**kwargs):
+    get_url_writer().flush()
 
 
 @app.task(
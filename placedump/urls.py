@@ -0,0 +1,284 @@
+import datetime
+import logging
+import os
+import threading
+import time
+import uuid
+from functools import lru_cache
+from typing import Iterable, List, Set, Tuple
+
+import redis as redis_sync
+from cassandra.concurrent import execute_concurrent_with_args
+from pottery import BloomFilter
+
+from placedump.common import get_redis
+from placedump.model import get_cass, prepare_cass
+
+log = logging.getLogger(__name__)
+
+SEEN_KEY = "seen:urls"
+SEEN_CAPACITY = int(os.environ.get("SEEN_URLS_CAPACITY", "10000000"))
+SEEN_FALSE_POSITIVES = 0.001
+
+# Registry writes, buffered per process.
+WRITE_BATCH_SIZE = int(os.environ.get("URL_WRITE_BATCH_SIZE", "256"))
+WRITE_INTERVAL = float(os.environ.get("URL_WRITE_INTERVAL", "1.0"))
+WRITE_CONCURRENCY = 64
+# Rows kept for retry while Cassandra is failing, the oldest are dropped past
+# this. Failed flushes back off up to WRITE_RETRY_MAX seconds.
+WRITE_BUFFER_MAX = int(os.environ.get("URL_WRITE_BUFFER_MAX", "16384"))
+WRITE_RETRY_MAX = 30.0
+
+# Download claims, one key per URL holding a worker token or "done".
+CLAIM_LEASE_MS = int(os.environ.get("DOWNLOAD_LEASE_MS", "60000"))
+CLAIM_DONE_TTL = 86400
+CLAIMED = "claimed"
+BUSY = "busy"
+DONE = "done"
+
+# Leases expire through PX, so a dead worker's claim frees itself.
+CLAIM_SCRIPT = """
+local state = redis.call("GET", KEYS[1])
+if state == "done" then
+    return "done"
+elseif state then
+    return "busy"
+end
+redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[2])
+return "claimed"
+"""
+
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# Frees a claim whatever token holds it, unless the URL is done.
+ABANDON_SCRIPT = """
+if redis.call("GET", KEYS[1]) ~= "done" then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+@lru_cache
+def get_seen_filter() -> BloomFilter:
+    # ~18MB of Redis bitmap for the default capacity.
+    return BloomFilter(
+        num_elements=SEEN_CAPACITY,
+        false_positives=SEEN_FALSE_POSITIVES,
+        redis=get_redis(),
+        key=SEEN_KEY,
+    )
+
+
+def mark_seen(urls: Iterable[str]):
+    get_seen_filter().update(urls)
+
+
+def get_fetched(urls: List[str]) -> Set[str]:
+    results = execute_concurrent_with_args(
+        get_cass(),
+        prepare_cass("SELECT url FROM urls WHERE url = ?"),
+        [(url,) for url in urls],
+        concurrency=64,
+    )
+
+    fetched = set()
+    for success, rows in results:
+        if success:
+            fetched.update(row.url for row in rows)
+
+    return fetched
+
+
+def filter_unseen(urls: List[str]) -> List[str]:
+    """Drop URLs that have already been fetched.
+
+    The Bloom filter answers most lookups in one pipelined round trip, hits
+    are confirmed against the urls table so false positives still download.
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return []
+
+    hits = [
+        url for url, hit in zip(urls, get_seen_filter().contains_many(*urls)) if hit
+    ]
+    fetched = get_fetched(hits) if hits else set()
+
+    return [url for url in urls if url not in fetched]
+
+
+def claim_key(url: str) -> str:
+    return f"download:{url}"
+
+
+def new_token() -> str:
+    return uuid.uuid4().hex
+
+
+def claim_url(
+    redis: redis_sync.Redis, url: str, token: str, lease_ms: int = CLAIM_LEASE_MS
+) -> str:
+    """Try to take the download of a URL in one round trip.
+
+    Returns CLAIMED if the caller now holds the lease, BUSY if another worker
+    holds it and DONE if the URL was already downloaded.
+    """
+    result = redis.register_script(CLAIM_SCRIPT)(
+        keys=[claim_key(url)], args=[token, lease_ms]
+    )
+    return result.decode() if isinstance(result, bytes) else result
+
+
+def complete_urls(redis: redis_sync.Redis, urls: Iterable[str]):
+    # Done wins over any lease, including one taken after ours expired.
+    pipe = redis.pipeline(transaction=False)
+    for url in urls:
+        pipe.set(claim_key(url), DONE, ex=CLAIM_DONE_TTL)
+    pipe.execute()
+
+
+def release_url(redis: redis_sync.Redis, url: str, token: str):
+    # Give up a failed claim so a retry doesn't wait out the lease.
+    redis.register_script(RELEASE_SCRIPT)(keys=[claim_key(url)], args=[token])
+
+
+def abandon_urls(redis: redis_sync.Redis, urls: Iterable[str]):
+    # Free claims whose rows were dropped so the next message redoes them.
+    script = redis.register_script(ABANDON_SCRIPT)
+    for url in urls:
+        script(keys=[claim_key(url)])
+
+
+Row = Tuple[str, datetime.datetime, int, str]
+
+
+class UrlWriter:
+    """Buffers urls rows and writes them in concurrent prepared batches.
+
+    `url` is the primary key, so rows are plain upserts rather than
+    `IF NOT EXISTS` and skip the Paxos round. Download claims keep two
+    workers from fetching the same URL, a rare re-fetch only moves
+    `fetched` forward. Claims are marked done and URLs marked seen once
+    their rows are stored. Rows that fail to write stay buffered, up to
+    `max_buffer` of them, and flushing backs off while writes fail. Past
+    that the oldest rows are dropped and their claims freed so they are
+    downloaded again.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = WRITE_BATCH_SIZE,
+        interval: float = WRITE_INTERVAL,
+        max_buffer: int = WRITE_BUFFER_MAX,
+    ):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self.rows: List[Row] = []
+        self.lock = threading.Lock()
+        # Held for the whole write so flushes don't interleave.
+        self.flush_lock = threading.Lock()
+        self.flushed = time.monotonic()
+        self.failures = 0
+        self.retry_at = 0.0
+        self.thread = None
+
+    def add(self, url: str, size: int, digest: str):
+        with self.lock:
+            self.rows.append((url, datetime.datetime.utcnow(), size, digest))
+            full = len(self.rows) >= self.batch_size
+            full = full and time.monotonic() >= self.retry_at
+
+            # Partial batches are written from a timer thread.
+            if not self.thread:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+            self.flushed = time.monotonic()
+
+            if not rows:
+                return
+
+            try:
+                failed = self._write(rows)
+            except Exception:
+                log.exception("url writer batch failed")
+                failed = rows
+
+            if not failed:
+                self.failures = 0
+                self.retry_at = 0.0
+                return
+
+            self.failures += 1
+            delay = min(WRITE_RETRY_MAX, self.interval * 2**self.failures)
+            self.retry_at = time.monotonic() + delay
+            log.warning(
+                "failed writing %s url rows, retrying in %.1fs", len(failed), delay
+            )
+
+            with self.lock:
+                self.rows[:0] = failed
+                dropped = self.rows[: max(0, len(self.rows) - self.max_buffer)]
+                del self.rows[: len(dropped)]
+
+            if dropped:
+                log.error("url writer buffer full, dropped %s rows", len(dropped))
+                try:
+                    abandon_urls(get_redis(), [row[0] for row in dropped])
+                except redis_sync.RedisError:
+                    log.exception("freeing dropped url claims failed")
+
+    def _write(self, rows: List[Row]) -> List[Row]:
+        results = execute_concurrent_with_args(
+            get_cass(),
+            prepare_cass(
+                "INSERT INTO urls (url, fetched, size, hash) VALUES (?, ?, ?, ?)"
+            ),
+            rows,
+            concurrency=WRITE_CONCURRENCY,
+        )
+
+        written = []
+        failed = []
+        for row, (success, _) in zip(rows, results):
+            (written if success else failed).append(row)
+
+        if written:
+            urls = [row[0] for row in written]
+            complete_urls(get_redis(), urls)
+            mark_seen(urls)
+
+        return failed
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if time.monotonic() - self.flushed < self.interval:
+                continue
+            if time.monotonic() < self.retry_at:
+                continue
+
+            try:
+                self.flush()
+            except Exception:
+                log.exception("url writer flush failed")
+
+
+@lru_cache
+def get_url_writer() -> UrlWriter:
+    # Created lazily so each forked worker gets its own buffer and thread.
+    return UrlWriter()
@@ -0,0 +1,49 @@
+"""Write the pixel change log for a range of archived frames.
+
+Every diff frame's pixels between --since and --until are written to a new
+change log in CHANGELOG_DIR, see placedump/changelog.py. Build ranges that
+don't overlap, the reader doesn't deduplicate.
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from placedump.canvas import Reconstructor, iter_frames
+from placedump.changelog import ChangeLogWriter, build
+from placedump.decodepool import DecodePool
+
+log = logging.getLogger("build_changelog")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--since", type=int, default=0, help="unix ms")
+    parser.add_argument("--until", type=int, default=sys.maxsize, help="unix ms")
+    parser.add_argument("--canvas", default=None, help="only this board")
+    parser.add_argument(
+        "--processes", type=int, default=0, help="decode on this many processes"
+    )
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    decoder = DecodePool(workers=args.processes) if args.processes else None
+    reconstructor = Reconstructor(decoder=decoder)
+    writer = ChangeLogWriter()
+
+    frames = iter_frames(args.since, args.until, canvas=args.canvas)
+    gaps = build(writer, frames, reconstructor)
+    writer.close()
+    reconstructor.close()
+
+    log.info(
+        "wrote %s changes in %.1fs, %s gaps",
+        writer.written,
+        time.monotonic() - started,
+        gaps,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Write canvas keyframes for a range of archived frames.
+
+Replays the archive from --since to --until and writes a keyframe per board
+every SNAPSHOT_INTERVAL_MS of canvas time or SNAPSHOT_EVERY_DIFFS frames into
+SNAPSHOT_DIR, see placedump/snapshots.py.
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+from placedump.canvas import Reconstructor, iter_frames
+from placedump.decodepool import DecodePool
+from placedump.snapshots import SnapshotStore, build
+
+log = logging.getLogger("build_snapshots")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--since", type=int, default=0, help="unix ms")
+    parser.add_argument("--until", type=int, default=sys.maxsize, help="unix ms")
+    parser.add_argument("--canvas", default=None, help="only this board")
+    parser.add_argument(
+        "--processes", type=int, default=0, help="decode on this many processes"
+    )
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    store = SnapshotStore()
+    decoder = DecodePool(workers=args.processes) if args.processes else None
+    reconstructor = Reconstructor(decoder=decoder)
+
+    build(store, iter_frames(args.since, args.until, canvas=args.canvas), reconstructor)
+    reconstructor.close()
+
+    for board, (last, _) in sorted(store.progress.items()):
+        log.info("board %s last keyframe at %s", board, last)
+    log.info("done in %.1fs", time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
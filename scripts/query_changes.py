@@ -0,0 +1,36 @@
+"""Print pixel changes from the change log as CSV.
+
+Only chunks overlapping the board, --region and time range are read.
+Columns are board, x, y, color index and timestamp (unix ms).
+"""
+
+import argparse
+import csv
+import sys
+
+from placedump.changelog import load_changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--board", type=int, default=None)
+    parser.add_argument("--region", default=None, help="x0,y0,x1,y1, end exclusive")
+    parser.add_argument("--since", type=int, default=None, help="unix ms")
+    parser.add_argument("--until", type=int, default=None, help="unix ms")
+    args = parser.parse_args()
+
+    region = None
+    if args.region:
+        region = tuple(int(value) for value in args.region.split(","))
+        if len(region) != 4:
+            parser.error("--region takes x0,y0,x1,y1")
+
+    changes = load_changes(args.board, region, args.since, args.until)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(changes.dtype.names)
+    writer.writerows(changes.tolist())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Rebuild the canvas at a point in time from archived frames.
+
+Frame messages between --since and --at are read from the archive segments,
+the boards are rebuilt from their latest full frame plus diffs and written out
+as one PNG. With --snapshots, each board starts from its nearest keyframe and
+only the diffs after it are read. Frames are read through the node's frame
+cache.
+"""
+
+import argparse
+import logging
+import time
+
+from placedump.canvas import Reconstructor, compose, iter_frames
+from placedump.decodepool import DecodePool
+from placedump.layout import get_offsets
+from placedump.snapshots import SnapshotStore, board_at
+
+log = logging.getLogger("render_canvas")
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--at", type=int, default=None, help="unix ms, default now")
+    parser.add_argument("--since", type=int, default=None, help="unix ms")
+    parser.add_argument("--canvas", default=None, help="only this board")
+    parser.add_argument(
+        "--processes", type=int, default=0, help="decode on this many processes"
+    )
+    parser.add_argument("--output", default="canvas.png")
+    parser.add_argument("--snapshots", action="store_true", help="use keyframes")
+    args = parser.parse_args()
+
+    at = args.at or int(time.time() * 1000)
+    since = args.since or at - DAY_MS
+
+    started = time.monotonic()
+    offsets = get_offsets()
+    decoder = DecodePool(workers=args.processes) if args.processes else None
+    reconstructor = Reconstructor(decoder=decoder)
+
+    if args.snapshots:
+        store = SnapshotStore()
+        indexes = [int(args.canvas)] if args.canvas is not None else sorted(offsets)
+        for index in indexes:
+            board_at(index, at, store, at - since, reconstructor)
+        boards = reconstructor.boards
+    else:
+        frames = list(iter_frames(since, at, canvas=args.canvas))
+        log.info("read %s frames in %.1fs", len(frames), time.monotonic() - started)
+        boards = reconstructor.reconstruct(frames, at)
+
+    reconstructor.close()
+
+    for index, board in sorted(boards.items()):
+        log.info("board %s at %s, %s gaps", index, board.timestamp, board.gaps)
+
+    if args.canvas is not None:
+        if int(args.canvas) not in boards:
+            parser.error(f"no frames for board {args.canvas} up to {at}")
+        image = boards[int(args.canvas)].to_image(reconstructor.palette)
+    elif not boards:
+        parser.error(f"no frames for any board up to {at}")
+    else:
+        image = reconstructor.palette.to_image(compose(boards, offsets))
+
+    image.save(args.output)
+    log.info("wrote %s in %.1fs", args.output, time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
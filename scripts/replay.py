@@ -0,0 +1,196 @@
+"""Replay archived messages through the ingest path for load testing.
+
+Messages are read from archive segments or a Redis stream and pushed through
+the same FanoutBuffer as dump.py, at real time (--speed 1), N times real time
+(--speed N) or as fast as possible (--speed 0). Point REDIS_URL and the Celery
+env at a test deployment, and --media-url at a local file server holding the
+frames, e.g. `python -m http.server` in a directory of hot-potato.reddit.com
+paths.
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import sys
+import time
+
+import redis
+
+from placedump.archive import LAST_KEY, read_range, stream_id_ms
+from placedump.common import REDIS_URL, get_redis
+from placedump.constants import socket_key
+from placedump.frames import frame_header
+from placedump.ingest import FanoutBuffer, stream_payload
+from placedump.tasks import redis_url as broker_url
+
+log = logging.getLogger("replay")
+MEDIA_HOST = "https://hot-potato.reddit.com"
+REPORT_INTERVAL = 5
+# Messages read from the source per executor call.
+READ_BATCH = 1000
+
+
+def iter_archive(args):
+    yield from read_range(args.start, args.end, canvas=args.canvas)
+
+
+def iter_stream(args):
+    source = redis.from_url(args.source_redis, decode_responses=True)
+    last_id = str(args.start)
+
+    while True:
+        results = source.xread({args.source_key: last_id}, count=10000)
+        if not results:
+            break
+
+        for message_id, fields in results[0][1]:
+            last_id = message_id
+            if stream_id_ms(message_id) > args.end:
+                return
+
+            yield message_id, fields.get("canvas_id", ""), fields["message"]
+
+
+async def read_source(source):
+    # Archive reads and xread block, keep them off the event loop.
+    loop = asyncio.get_running_loop()
+
+    while True:
+        batch = await loop.run_in_executor(
+            None, list, itertools.islice(source, READ_BATCH)
+        )
+        if not batch:
+            return
+
+        for item in batch:
+            yield item
+
+
+def build_payload(message: str, canvas_id: str, media_url: str) -> dict:
+    if media_url:
+        message = message.replace(MEDIA_HOST, media_url)
+        message = message.replace(
+            MEDIA_HOST.replace("/", "\\/"), media_url.replace("/", "\\/")
+        )
+
+    # Built the same way dump.py builds them.
+    raw = bool(frame_header(message)) and '"payload"' in message
+    return stream_payload(message, canvas_id, raw)
+
+
+def get_stage_lag(target: redis.Redis, broker: redis.Redis, key: str) -> dict:
+    lag = {}
+
+    try:
+        for group in target.xinfo_groups(key):
+            lag[group["name"]] = group.get("lag")
+    except redis.ResponseError:
+        pass
+
+    # The archiver checkpoints by stream id, report how far behind it is in time.
+    last_entry = target.xrevrange(key, count=1)
+    archived = target.get(LAST_KEY)
+    if last_entry and archived:
+        lag["archiver_ms"] = stream_id_ms(last_entry[0][0]) - stream_id_ms(archived)
+
+    lag["celery"] = broker.llen("celery")
+
+    return lag
+
+
+async def report(fanout: FanoutBuffer, counters: dict):
+    target = get_redis()
+    broker = redis.from_url(broker_url, decode_responses=True)
+    last_count = 0
+    last_time = time.monotonic()
+
+    while True:
+        await asyncio.sleep(REPORT_INTERVAL)
+
+        now = time.monotonic()
+        rate = (counters["sent"] - last_count) / (now - last_time)
+        last_count, last_time = counters["sent"], now
+
+        log.info(
+            "sent %s (%.0f msg/s), behind schedule %.2fs, fanout pending %s "
+            "last flush %sms, stage lag %s",
+            counters["sent"],
+            rate,
+            counters["behind"],
+            fanout.queue.qsize(),
+            fanout.stats["last_flush_ms"],
+            get_stage_lag(target, broker, fanout.key),
+        )
+
+
+async def replay(args):
+    fanout = FanoutBuffer(args.key)
+    counters = {"sent": 0, "behind": 0.0}
+    tasks = [
+        asyncio.create_task(fanout.run()),
+        asyncio.create_task(report(fanout, counters)),
+    ]
+
+    source = iter_stream(args) if args.source == "redis" else iter_archive(args)
+    started = time.monotonic()
+    first_ts = None
+
+    async for message_id, canvas_id, message in read_source(source):
+        timestamp = stream_id_ms(message_id)
+        if first_ts is None:
+            first_ts = timestamp
+
+        # Keep to the original schedule, scaled by speed.
+        if args.speed > 0:
+            due = started + (timestamp - first_ts) / 1000 / args.speed
+            delay = due - time.monotonic()
+            counters["behind"] = max(-delay, 0.0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        payload = build_payload(message, canvas_id, args.media_url)
+        await fanout.put(payload, canvas_id or None)
+        counters["sent"] += 1
+
+        if counters["sent"] % 1000 == 0:
+            await asyncio.sleep(0)
+
+    await fanout.queue.join()
+    elapsed = time.monotonic() - started
+    log.info(
+        "replayed %s messages in %.1fs, %.0f msg/s sustained",
+        counters["sent"],
+        elapsed,
+        counters["sent"] / max(elapsed, 0.001),
+    )
+
+    for task in tasks:
+        task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=["archive", "redis"], default="archive")
+    parser.add_argument("--source-redis", default=REDIS_URL)
+    parser.add_argument("--source-key", default=socket_key)
+    parser.add_argument("--key", default=socket_key, help="stream to replay into")
+    parser.add_argument("--start", type=int, default=0, help="unix ms")
+    parser.add_argument("--end", type=int, default=sys.maxsize, help="unix ms")
+    parser.add_argument("--canvas", default=None)
+    parser.add_argument("--speed", type=float, default=1.0, help="0 for unpaced")
+    parser.add_argument("--media-url", default=None, help="replaces " + MEDIA_HOST)
+    args = parser.parse_args()
+
+    if (
+        args.source == "redis"
+        and args.source_redis == REDIS_URL
+        and args.source_key == args.key
+    ):
+        parser.error("replaying a stream into itself, set --key")
+
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import backoff
+from redis import asyncio as aioredis
+from redis.exceptions import ResponseError
+
+from placedump.common import ctx_aioredis, handle_backoff
+from placedump.constants import socket_key
+from placedump.downloader import Downloader
+from placedump.layout import save_offsets
+from placedump.palette import save_palette
+from placedump.tasks import app
+from placedump.tasks.parse import (
+    get_canvas_id,
+    get_canvas_offsets,
+    get_highest_index,
+    get_palette_colors,
+    get_stream_canvas_id,
+    get_url,
+)
+from placedump.tasks.pixels import download_url
+from placedump.urls import filter_unseen
+
+log = logging.getLogger(__name__)
+pool = ThreadPoolExecutor(max_workers=1)
+tasks = []
+
+GROUP = "parser"
+CONSUMER = os.environ.get("PARSER_CONSUMER", f"{socket.gethostname()}-{os.getpid()}")
+BATCH_SIZE = int(os.environ.get("PARSER_BATCH_SIZE", "500"))
+CLAIM_IDLE_MS = int(os.environ.get("PARSER_CLAIM_IDLE_MS", "60000"))
+CLAIM_INTERVAL = 30
+
+# "celery" queues download_url tasks, "async" downloads in this process.
+DOWNLOAD_MODE = os.environ.get("PARSER_DOWNLOAD_MODE", "celery")
+downloader = Downloader() if DOWNLOAD_MODE == "async" else None
+
+
+async def ensure_group(redis: aioredis.Redis):
+    try:
+        await redis.xgroup_create(socket_key, GROUP, id="$", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def parse_batch(
+    messages: list,
+) -> Tuple[List[Tuple[int, str]], Optional[int], Optional[list], Optional[dict]]:
+    downloads = []
+    highest_index = None
+    palette = None
+    offsets = None
+
+    for _, fields in messages:
+        # Entries trimmed out of the stream while pending come back empty.
+        if not fields:
+            continue
+
+        canvas_id = get_stream_canvas_id(fields)
+
+        # Raw frames were routed at ingest, only config frames need decoding.
+        if (
+            fields.get("type") == "raw"
+            and fields.get("typename") != "ConfigurationMessageData"
+        ):
+            if fields.get("name"):
+                downloads.append((canvas_id, fields["name"]))
+            continue
+
+        try:
+            payload = json.loads(fields["message"])
+        except (KeyError, json.JSONDecodeError):
+            continue
+
+        index = get_highest_index(payload)
+        if index is not None:
+            highest_index = index
+
+        colors = get_palette_colors(payload)
+        if colors:
+            palette = colors
+
+        canvas_offsets = get_canvas_offsets(payload)
+        if canvas_offsets:
+            offsets = canvas_offsets
+
+        url = get_url(payload)
+        if url:
+            downloads.append((get_canvas_id(payload, canvas_id), url))
+
+    return downloads, highest_index, palette, offsets
+
+
+def get_unseen(downloads: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    # Skip anything that was already fetched.
+    unseen = set(filter_unseen([url for _, url in downloads]))
+    result = []
+
+    for canvas_id, url in downloads:
+        if url in unseen:
+            unseen.discard(url)
+            result.append((canvas_id, url))
+
+    return result
+
+
+def enqueue_downloads(downloads: List[Tuple[int, str]]):
+    # Reuse one broker connection for the whole batch.
+    with app.producer_or_acquire() as producer:
+        for canvas_id, url in downloads:
+            download_url.apply_async((canvas_id, url), producer=producer)
+
+
+async def handle_batch(redis: aioredis.Redis, messages: list):
+    if not messages:
+        return
+
+    downloads, highest_index, palette, offsets = parse_batch(messages)
+
+    if highest_index is not None:
+        await redis.hset("place:meta", "index", highest_index)
+    if palette:
+        await save_palette(redis, palette)
+    if offsets:
+        await save_offsets(redis, offsets)
+
+    if downloads:
+        loop = asyncio.get_running_loop()
+        downloads = await loop.run_in_executor(pool, get_unseen, downloads)
+
+    if downloads and downloader:
+        await downloader.download_many(downloads)
+        await downloader.flush_rows()
+    elif downloads:
+        await loop.run_in_executor(pool, enqueue_downloads, downloads)
+
+    # Ack only after the downloads are handed off.
+    await redis.xack(socket_key, GROUP, *[message_id for message_id, _ in messages])
+
+
+@backoff.on_exception(
+    backoff.fibo,
+    Exception,
+    max_time=30,
+    on_backoff=handle_backoff,
+    on_giveup=handle_backoff,
+)
+async def consume():
+    async with ctx_aioredis() as redis:
+        await ensure_group(redis)
+        log.info("consuming %s as %s/%s", socket_key, GROUP, CONSUMER)
+
+        # Drain our own pending entries first in case we restarted mid-batch.
+        last_id = "0"
+
+        while True:
+            results = await redis.xreadgroup(
+                GROUP,
+                CONSUMER,
+                {socket_key: last_id},
+                count=BATCH_SIZE,
+                block=5000,
+            )
+            messages = results[0][1] if results else []
+
+            if last_id == "0" and not messages:
+                last_id = ">"
+                continue
+
+            await handle_batch(redis, messages)
+
+
+@backoff.on_exception(
+    backoff.fibo,
+    Exception,
+    max_time=30,
+    on_backoff=handle_backoff,
+    on_giveup=handle_backoff,
+)
+async def reclaim():
+    async with ctx_aioredis() as redis:
+        await ensure_group(redis)
+
+        while True:
+            # Take over entries that dead consumers never acked.
+            start_id = "0-0"
+            while True:
+                start_id, messages, *_ = await redis.xautoclaim(
+                    socket_key,
+                    GROUP,
+                    CONSUMER,
+                    CLAIM_IDLE_MS,
+                    start_id=start_id,
+                    count=BATCH_SIZE,
+                )
+
+                if messages:
+                    log.info("claimed %s stale messages", len(messages))
+                    await handle_batch(redis, messages)
+
+                if start_id == "0-0":
+                    break
+
+            # Forget consumers that are idle and own nothing.
+            for consumer in await redis.xinfo_consumers(socket_key, GROUP):
+                if (
+                    consumer["name"] != CONSUMER
+                    and consumer["pending"] == 0
+                    and consumer["idle"] > CLAIM_IDLE_MS * 10
+                ):
+                    await redis.xgroup_delconsumer(socket_key, GROUP, consumer["name"])
+
+            await asyncio.sleep(CLAIM_INTERVAL)
+
+
+async def main():
+    tasks.append(asyncio.create_task(consume()))
+    tasks.append(asyncio.create_task(reclaim()))
+
+    await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
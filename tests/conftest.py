@@ -0,0 +1,20 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+
+def make_png(pixels: dict, size=(4, 4)) -> bytes:
+    # A transparent frame with the given {(x, y): rgba} pixels drawn in.
+    img = Image.new("RGBA", size, (0, 0, 0, 0))
+    for xy, color in pixels.items():
+        img.putpixel(xy, color)
+
+    f_data = BytesIO()
+    img.save(f_data, format="PNG")
+    return f_data.getvalue()
+
+
+@pytest.fixture
+def png():
+    return make_png
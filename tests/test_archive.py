@@ -0,0 +1,98 @@
+import json
+import os
+
+import zstandard
+
+from placedump import archive
+from placedump.archive import SegmentWriter, list_segments, load_index, read_range
+
+
+def write_messages(directory, count: int, messages=None):
+    checkpoints = []
+    writer = SegmentWriter(checkpoints.append, directory=str(directory), frame_size=512)
+    writer.start()
+
+    messages = messages or [
+        (
+            b"%d-0" % (1000 + x),
+            {b"message": b'{"x":%d}' % x, b"canvas_id": b"%d" % (x % 2)},
+        )
+        for x in range(0, count)
+    ]
+    writer.write(messages)
+    writer.close()
+
+    return checkpoints
+
+
+def test_segment_roundtrip(tmp_path):
+    checkpoints = write_messages(tmp_path, 200)
+    assert checkpoints == [b"1199-0"]
+
+    segments = list_segments(str(tmp_path))
+    assert len(segments) == 1
+    assert len(load_index(segments[0])) > 1
+
+    # Frames concatenate into a regular zstd file.
+    with open(segments[0], "rb") as f:
+        data = (
+            zstandard.ZstdDecompressor()
+            .stream_reader(f, read_across_frames=True)
+            .read()
+        )
+    assert data.count(b"\n") == 200
+
+
+def test_read_range(tmp_path):
+    write_messages(tmp_path, 200)
+
+    messages = list(read_range(1050, 1059, directory=str(tmp_path)))
+    assert [message_id for message_id, _, _ in messages][0] == "1050-0"
+    assert len(messages) == 10
+
+    messages = list(read_range(1050, 1059, canvas=1, directory=str(tmp_path)))
+    assert [message for _, _, message in messages][0] == '{"x":51}'
+    assert len(messages) == 5
+
+
+def test_partial_segments_removed(tmp_path):
+    partial = tmp_path / "1-logs-partial.txt.zst.tmp"
+    partial.write_bytes(b"")
+
+    write_messages(tmp_path, 1)
+    assert not os.path.exists(partial)
+
+
+def text_messages(count: int):
+    # Text mode before the stream field, canvas_id only inside the message.
+    return [
+        (
+            b"%d-0" % (1000 + x),
+            {
+                b"message": json.dumps({"x": x, "canvas_id": x % 2}).encode(),
+                b"type": b"text",
+            },
+        )
+        for x in range(0, count)
+    ]
+
+
+def test_read_range_text_mode(tmp_path):
+    write_messages(tmp_path, 20, text_messages(20))
+
+    assert load_index(list_segments(str(tmp_path))[0])[0]["canvases"] == ["0", "1"]
+    messages = list(read_range(1000, 1019, canvas=0, directory=str(tmp_path)))
+    assert len(messages) == 10
+    assert {canvas_id for _, canvas_id, _ in messages} == {"0"}
+
+
+def test_read_range_legacy_text_mode(tmp_path, monkeypatch):
+    # Segments archived with an empty canvas id column.
+    monkeypatch.setattr(archive, "fields_canvas_id", lambda fields: b"")
+    write_messages(tmp_path, 20, text_messages(20))
+    monkeypatch.undo()
+
+    assert load_index(list_segments(str(tmp_path))[0])[0]["canvases"] == [""]
+    messages = list(read_range(1000, 1019, canvas=1, directory=str(tmp_path)))
+    assert len(messages) == 10
+    assert {canvas_id for _, canvas_id, _ in messages} == {"1"}
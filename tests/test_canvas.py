@@ -0,0 +1,86 @@
+import json
+
+import numpy as np
+
+from placedump.canvas import (
+    DIFF_FRAME,
+    FULL_FRAME,
+    Frame,
+    Reconstructor,
+    compose,
+    order_frames,
+    parse_frame,
+)
+from placedump.palette import PALETTE_2022, TRANSPARENT, Palette
+
+
+def test_parse_frame():
+    message = json.dumps(
+        {
+            "id": "3",
+            "type": "data",
+            "payload": {
+                "data": {
+                    "subscribe": {
+                        "data": {
+                            "__typename": DIFF_FRAME,
+                            "name": "https://example.com/1-d.png",
+                            "currentTimestamp": 2000,
+                            "previousTimestamp": 1000,
+                        }
+                    }
+                }
+            },
+        }
+    )
+
+    assert parse_frame("2", message) == Frame(
+        2, DIFF_FRAME, "https://example.com/1-d.png", 2000.0, 1000.0
+    )
+    assert parse_frame("", message).board == 1
+    assert parse_frame("0", '{"type": "ka"}') is None
+
+
+def test_reconstruct(png):
+    red, blue = (255, 69, 0, 255), (36, 80, 164, 255)
+    red_index, blue_index = PALETTE_2022.index("#FF4500"), PALETTE_2022.index("#2450A4")
+    images = {
+        "full": png({(0, 0): red, (1, 0): red}),
+        "diff1": png({(1, 0): blue}),
+        "diff2": png({(2, 2): blue}),
+        "late": png({(3, 3): red}),
+    }
+    frames = [
+        Frame(0, DIFF_FRAME, "diff2", 3000.0, 2000.0),
+        Frame(0, DIFF_FRAME, "stale", 500.0, 400.0),
+        Frame(0, FULL_FRAME, "full", 1000.0, None),
+        Frame(0, DIFF_FRAME, "diff1", 2000.0, 1000.0),
+        Frame(0, DIFF_FRAME, "late", 4000.0, 3000.0),
+    ]
+
+    assert [frame.url for frame in order_frames(frames, at=3000)] == [
+        "full",
+        "diff1",
+        "diff2",
+    ]
+
+    palette = Palette()
+    reconstructor = Reconstructor(fetch=images.__getitem__, workers=2, palette=palette)
+    board = reconstructor.reconstruct(frames, at=3000)[0]
+    reconstructor.close()
+
+    assert board.timestamp == 3000.0
+    assert board.gaps == 0
+    assert board.pixels[0, 0] == red_index
+    assert board.pixels[0, 1] == blue_index
+    assert board.pixels[2, 2] == blue_index
+    assert board.pixels[3, 3] == TRANSPARENT
+    assert board.to_image(palette).convert("RGBA").getpixel((1, 0)) == blue
+
+    canvas = compose({0: board, 1: board}, {0: (0, 0), 1: (4, 0)})
+    assert canvas.shape == (4, 8)
+    assert np.array_equal(canvas[:, 4:], board.pixels)
+
+    # Boards the layout doesn't know are left out rather than failing.
+    canvas = compose({0: board, 7: board}, {0: (0, 0)})
+    assert canvas.shape == (4, 4)
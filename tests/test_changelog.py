@@ -0,0 +1,57 @@
+import numpy as np
+
+from placedump.canvas import DIFF_FRAME, FULL_FRAME, Frame, Reconstructor
+from placedump.changelog import ChangeLogWriter, build, load_changes, read_changes
+from placedump.palette import PALETTE_2022, Palette
+
+
+def test_write_and_filter(tmp_path):
+    writer = ChangeLogWriter(str(tmp_path), chunk_rows=4, tile=100)
+    for timestamp in range(10):
+        xs = np.array([timestamp, 150, 250])
+        ys = np.array([0, 150, 250])
+        writer.add(timestamp % 2, 1000 + timestamp, xs, ys, xs % 32)
+    writer.close()
+
+    everything = load_changes(directory=str(tmp_path))
+    assert len(everything) == 30
+    assert (np.diff(everything["timestamp"]) >= 0).all()
+
+    # One tile of one board, and only its chunks are read.
+    region = (100, 100, 200, 200)
+    chunks = list(read_changes(0, region, directory=str(tmp_path)))
+    assert sum(len(chunk) for chunk in chunks) == 5
+    assert all((chunk["x"] == 150).all() for chunk in chunks)
+
+    changes = load_changes(1, None, 1003, 1005, directory=str(tmp_path))
+    assert changes["timestamp"].tolist() == [1003] * 3 + [1005] * 3
+    assert changes[0].tolist() == (1, 3, 0, 3, 1003)
+
+
+def test_build(tmp_path, png):
+    orange, blue = (255, 69, 0, 255), (36, 80, 164, 255)
+    images = {
+        "d1": png({(0, 0): orange, (299, 10): blue}, size=(300, 300)),
+        "d2": png({(0, 0): blue}, size=(300, 300)),
+        "d4": png({(5, 5): orange}, size=(300, 300)),
+    }
+    frames = [
+        Frame(0, DIFF_FRAME, "d4", 4000.0, 3000.0),
+        Frame(0, FULL_FRAME, "full", 500.0, None),
+        Frame(0, DIFF_FRAME, "d1", 1000.0, 500.0),
+        Frame(0, DIFF_FRAME, "d2", 2000.0, 1000.0),
+    ]
+
+    writer = ChangeLogWriter(str(tmp_path))
+    reconstructor = Reconstructor(fetch=images.__getitem__, palette=Palette())
+    assert build(writer, frames, reconstructor) == 1
+    writer.close()
+    reconstructor.close()
+
+    changes = load_changes(directory=str(tmp_path))
+    assert [tuple(change)[1:] for change in changes.tolist()] == [
+        (0, 0, PALETTE_2022.index("#FF4500"), 1000),
+        (299, 10, PALETTE_2022.index("#2450A4"), 1000),
+        (0, 0, PALETTE_2022.index("#2450A4"), 2000),
+        (5, 5, PALETTE_2022.index("#FF4500"), 4000),
+    ]
@@ -0,0 +1,80 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from placedump.canvas import DIFF_FRAME, FULL_FRAME, Frame, Reconstructor
+from placedump.decodepool import DecodePool
+from placedump.palette import PALETTE_2022, TRANSPARENT, Palette
+
+ORANGE = (255, 69, 0, 255)
+
+
+def fetch(key: str) -> bytes:
+    # "{x}" is a 4x4 frame with one orange pixel at (x, 0).
+    if key == "broken":
+        return b"not a png"
+
+    img = Image.new("RGBA", (4, 4), (0, 0, 0, 0))
+    img.putpixel((int(key), 0), ORANGE)
+
+    f_data = BytesIO()
+    img.save(f_data, format="PNG")
+    return f_data.getvalue()
+
+
+def test_imap_in_order():
+    keys = ["0", "1", "broken", "3", "2"] * 4
+
+    with DecodePool(fetch, Palette(), workers=2, slots=3, slot_size=16) as pool:
+        for key, handle in zip(keys, pool.imap(keys)):
+            assert handle.key == key
+            if key == "broken":
+                assert handle.error is not None
+                continue
+
+            with handle:
+                row = handle.array[0]
+                assert row[int(key)] == PALETTE_2022.index("#FF4500")
+                assert (row != TRANSPARENT).sum() == 1
+
+        assert len(pool.free) == 3
+
+
+def test_imap_bounded():
+    with DecodePool(fetch, Palette(), workers=1, slots=2, slot_size=16) as pool:
+        held = []
+        with pytest.raises(RuntimeError):
+            for handle in pool.imap(["0", "1", "2"]):
+                held.append(handle)
+
+        assert len(held) == 2
+        for handle in held:
+            handle.release()
+        assert len(pool.free) == 2
+
+
+def test_imap_abandoned():
+    with DecodePool(fetch, Palette(), workers=2, slots=3, slot_size=16) as pool:
+        for handle in pool.imap(["0", "1", "2", "3"]):
+            handle.release()
+            break
+
+        # Frames decoded ahead give their slots back too.
+        assert len(pool.free) == 3
+
+
+def test_reconstruct_with_decoder():
+    frames = [
+        Frame(0, FULL_FRAME, "0", 1000.0, None),
+        Frame(0, DIFF_FRAME, "3", 2000.0, 1000.0),
+    ]
+    palette = Palette()
+    decoder = DecodePool(fetch, palette, workers=2, slots=2, slot_size=16)
+
+    reconstructor = Reconstructor(palette=palette, decoder=decoder)
+    board = reconstructor.reconstruct(frames)[0]
+    reconstructor.close()
+
+    assert board.timestamp == 2000.0
+    assert (board.pixels[0] != TRANSPARENT).tolist() == [True, False, False, True]
@@ -0,0 +1,93 @@
+import os
+import time
+
+from placedump import framecache
+from placedump.framecache import FrameCache, url_key
+from placedump.storage import content_hash
+
+
+def test_put_get_discard(tmp_path):
+    cache = FrameCache(str(tmp_path))
+    data = b"\x89PNG frame"
+    digest = content_hash(data)
+
+    assert cache.get_cached(digest) is None
+
+    path = cache.put(digest, data)
+    assert path == cache.path(digest)
+    assert cache.get(digest) == data
+    assert os.listdir(os.path.dirname(path)) == [f"{digest}.png"]
+
+    with cache.open_frame(digest) as f:
+        assert f.read() == data
+
+    cache.discard(digest)
+    cache.discard(digest)
+    assert cache.get_cached(digest) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = FrameCache(str(tmp_path), max_size=250)
+    first, second, third = [content_hash(bytes([i])) for i in range(3)]
+
+    cache.put(first, b"x" * 100)
+    cache.put(second, b"x" * 100)
+    os.utime(cache.path(first), (time.time() - 20, time.time() - 20))
+    os.utime(cache.path(second), (time.time() - 10, time.time() - 10))
+
+    # Reading the oldest entry makes it the most recent.
+    assert cache.get_cached(first) is not None
+    cache.put(third, b"x" * 100)
+
+    assert cache.get_cached(second) is None
+    assert cache.get_cached(first) is not None
+    assert cache.get_cached(third) is not None
+    assert cache.size <= 250
+
+
+def test_shared_size_scans_only_over_limit(tmp_path, monkeypatch):
+    first = FrameCache(str(tmp_path), max_size=250)
+    second = FrameCache(str(tmp_path), max_size=250)
+    first.put(content_hash(b"a"), b"x" * 100)
+
+    scans = []
+    entries = FrameCache.entries
+    monkeypatch.setattr(
+        FrameCache, "entries", lambda self: scans.append(1) or entries(self)
+    )
+
+    # The other process picks the size up from the shared estimate.
+    second.put(content_hash(b"b"), b"x" * 100)
+    assert second.size == 200 and second.added == 0
+    assert not scans
+
+    monkeypatch.setattr(framecache, "SYNC_INTERVAL", 0)
+    second.put(content_hash(b"c"), b"x" * 10)
+    assert second.size == 210
+    assert not scans
+
+    # Going over the limit measures the directory once and evicts.
+    first.put(content_hash(b"d"), b"x" * 100)
+    assert scans == [1]
+    assert first.size <= 250
+
+
+def test_get_url_resolves_manifest_once(tmp_path, monkeypatch):
+    cache = FrameCache(str(tmp_path))
+    data = b"\x89PNG frame"
+    digest = content_hash(data)
+    cache.put(digest, data)
+    cache.put(url_key("legacy"), b"legacy frame")
+
+    lookups = []
+
+    def get_manifest(url):
+        lookups.append(url)
+        return digest if url == "new" else None
+
+    monkeypatch.setattr(framecache, "get_manifest", get_manifest)
+
+    assert cache.get_url("new") == data
+    assert cache.get_url("new") == data
+    assert cache.get_url("legacy") == b"legacy frame"
+    assert lookups == ["new"]
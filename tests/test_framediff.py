@@ -0,0 +1,68 @@
+import numpy as np
+
+from placedump import framecache, framediff, pixelqueue
+from placedump.common import get_redis
+from placedump.palette import TRANSPARENT
+
+
+def test_parse_frame_url():
+    base = "https://hot-potato.reddit.com/media/canvas-images/"
+
+    assert framediff.parse_frame_url(base + "1648817050444-2-f-abc.png") == (
+        1648817050444,
+        2,
+        True,
+    )
+    assert framediff.parse_frame_url(base + "1648817050444-0-d-abc.png")[2] is False
+    assert framediff.parse_frame_url(base + "test.png") is None
+
+
+def test_changed_pixels():
+    previous = np.full((2, 2), TRANSPARENT, dtype=np.uint8)
+    previous[0, 0] = 2
+    current = np.full((2, 3), TRANSPARENT, dtype=np.uint8)
+    current[0, 0] = 2
+    current[1, 1] = 31
+    current[0, 2] = 12
+
+    assert sorted(framediff.changed_pixels(previous, current).tolist()) == [
+        [1, 1],
+        [2, 0],
+    ]
+
+
+def clear(redis):
+    redis.delete(
+        framediff.REF_PREFIX + "9",
+        pixelqueue.BITMAP_PREFIX + "9",
+        pixelqueue.ROWS_KEY,
+        pixelqueue.COUNT_KEY,
+    )
+
+
+def test_diff_full_frame(tmp_path, monkeypatch, png):
+    cache = framecache.FrameCache(str(tmp_path))
+    monkeypatch.setattr(framecache, "get_cache", lambda: cache)
+    framediff._decoded.clear()
+
+    redis = get_redis()
+    clear(redis)
+
+    red, blue = (255, 69, 0, 255), (36, 80, 164, 255)
+    frames = {
+        "a": png({(0, 0): red}),
+        "b": png({(0, 0): red, (1, 2): blue}),
+        "c": png({(0, 0): blue, (1, 2): blue}),
+    }
+    for digest, data in frames.items():
+        cache.put(digest, data)
+
+    # The first frame is only a reference.
+    assert framediff.diff_full_frame(redis, 9, 1000, "a") == []
+    assert framediff.diff_full_frame(redis, 9, 3000, "c") == [(0, 0), (1, 2)]
+
+    # A late frame diffs against the newer reference and doesn't replace it.
+    assert framediff.diff_full_frame(redis, 9, 2000, "b") == [(0, 0)]
+    assert redis.hget(framediff.REF_PREFIX + "9", "digest") == "c"
+
+    clear(redis)
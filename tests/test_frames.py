@@ -0,0 +1,59 @@
+import json
+
+from placedump.frames import extract_routing, frame_header
+from placedump.tasks.parse import get_canvas_id, get_url
+
+DIFF_FRAME = json.dumps(
+    {
+        "type": "data",
+        "id": "3",
+        "payload": {
+            "data": {
+                "subscribe": {
+                    "id": "a1b2",
+                    "data": {
+                        "__typename": "DiffFrameMessageData",
+                        "name": "https://hot-potato.reddit.com/media/canvas-images/1-d.png",
+                        "currentTimestamp": 1649112460185,
+                        "previousTimestamp": 1649112459185,
+                    },
+                }
+            }
+        },
+    }
+)
+
+
+def test_frame_header():
+    assert frame_header(DIFF_FRAME) == ("data", 3)
+    assert frame_header('{"type":"ka"}') == ("ka", None)
+    assert frame_header('{"payload":{"id":"1"}}') is None
+
+
+def test_extract_routing():
+    routing = extract_routing(DIFF_FRAME)
+
+    assert routing["typename"] == "DiffFrameMessageData"
+    assert routing["name"] == get_url(json.loads(DIFF_FRAME))
+    assert routing["currentTimestamp"] == "1649112460185"
+    assert "timestamp" not in routing
+
+
+def test_extract_routing_escaped():
+    routing = extract_routing('{"name":"https:\\/\\/example.com\\/1.png"}')
+
+    assert routing["name"] == "https://example.com/1.png"
+
+
+def test_get_canvas_id():
+    # Sockets are multiplexed, an explicit board wins over the op id.
+    payload = json.loads(DIFF_FRAME)
+    payload["id"] = "5"
+    assert get_canvas_id(payload, 0) == 0
+    assert get_canvas_id(dict(payload, canvas_id=0)) == 0
+    assert get_canvas_id(payload, 2) == 2
+
+    # Without one, fall back to the subscription id.
+    assert get_canvas_id(payload) == 3
+    assert get_canvas_id(payload, "") == 3
+    assert get_canvas_id({}) == 0
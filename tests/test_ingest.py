@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+import redis
+
+from placedump import ingest
+from placedump.ingest import FanoutBuffer, stream_payload
+
+
+def test_run_survives_flush_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "FLUSH_RETRY_MAX", 0)
+    fanout = FanoutBuffer(spill_dir=str(tmp_path), batch_delay=0)
+    flushed = []
+
+    def flush(batch):
+        # Redis is down for the first batch.
+        if not flushed:
+            flushed.append(None)
+            raise redis.ConnectionError("down")
+        flushed.extend(batch)
+
+    monkeypatch.setattr(fanout, "_flush", flush)
+
+    async def main():
+        task = asyncio.create_task(fanout.run())
+        await fanout.put({"message": "1"}, 0)
+        await fanout.queue.join()
+        await fanout.put({"message": "2"}, 0)
+        await fanout.queue.join()
+
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(main())
+
+    assert flushed[1:] == [({"message": "2"}, 0)]
+    assert fanout.stats["failed_flushes"] == 1
+    assert fanout.stats["flushed"] == 1 and fanout.stats["batches"] == 1
+    assert fanout.stats["spilled"] == 1
+    path, drained, items = fanout.spill.pop()
+    assert items == [({"message": "1"}, 0)]
+
+
+class FailingPipeline:
+    def __init__(self, sent, fail):
+        self.sent = sent
+        self.fail = fail
+        self.commands = []
+
+    def xadd(self, key, payload, **kwargs):
+        self.commands.append(payload["message"])
+
+    def publish(self, key, message):
+        pass
+
+    def hset(self, key, mapping):
+        pass
+
+    def execute(self):
+        if self.fail(self.commands):
+            raise redis.ConnectionError("down")
+        self.sent.extend(self.commands)
+
+
+def test_drain_resumes_after_failure(tmp_path, monkeypatch):
+    fanout = FanoutBuffer(spill_dir=str(tmp_path), batch_size=2)
+    fanout.spill.append([({"message": str(i)}, 0) for i in range(5)])
+    sent = []
+
+    # The second chunk fails, the first must not be sent again.
+    monkeypatch.setattr(
+        fanout.redis,
+        "pipeline",
+        lambda **kwargs: FailingPipeline(sent, lambda commands: "2" in commands),
+    )
+    with pytest.raises(redis.ConnectionError):
+        fanout._drain()
+    assert sent == ["0", "1"]
+
+    monkeypatch.setattr(
+        fanout.redis, "pipeline", lambda **kwargs: FailingPipeline(sent, lambda _: 0)
+    )
+    fanout._drain()
+    assert sent == ["0", "1", "2", "3", "4"]
+    assert not fanout.spill.pending
+    assert not list(tmp_path.iterdir())
+
+
+def test_spilling_survives_publish_failure(tmp_path, monkeypatch):
+    fanout = FanoutBuffer(spill_dir=str(tmp_path))
+    fanout.stats["lag"] = ingest.SPILL_HIGH
+    fanout.lag_checked = float("inf")
+    monkeypatch.setattr(
+        fanout.redis, "pipeline", lambda **kwargs: FailingPipeline([], lambda _: 1)
+    )
+
+    fanout._flush([({"message": "1"}, 0)])
+
+    path, drained, items = fanout.spill.pop()
+    assert items == [({"message": "1"}, 0)]
+
+
+def test_stream_payload():
+    text = stream_payload('{"id": "3"}', 1, raw=False)
+    assert text == {"message": '{"id": "3"}', "type": "text", "canvas_id": "1"}
+
+    frame = (
+        '{"id":"3","type":"data","payload":{"data":{"subscribe":{"data":'
+        '{"__typename":"DiffFrameMessageData","name":"https://x/1-1-d-a.png",'
+        '"currentTimestamp":2000,"previousTimestamp":1000}}}}}'
+    )
+    raw = stream_payload(frame, 0, raw=True)
+    assert raw["type"] == "raw" and raw["canvas_id"] == "0"
+    assert raw["name"] == "https://x/1-1-d-a.png"
@@ -0,0 +1,42 @@
+from placedump.layout import (
+    BOARD_OFFSETS,
+    load_offsets,
+    offsets_from_config,
+    save_offsets,
+)
+from placedump.tasks.parse import get_canvas_offsets
+
+
+class MetaHash:
+    def __init__(self):
+        self.fields = {}
+
+    def hset(self, key, field, value):
+        self.fields[(key, field)] = value
+
+    def hget(self, key, field):
+        return self.fields.get((key, field))
+
+
+def test_offsets_from_config():
+    payload = {
+        "subscribe": {
+            "data": {
+                "__typename": "ConfigurationMessageData",
+                "canvasConfigurations": [
+                    {"index": 5, "dx": 2000, "dy": 1000},
+                    {"index": 0, "dx": 0, "dy": 0},
+                ],
+            }
+        }
+    }
+    offsets = get_canvas_offsets(payload)
+    assert offsets == {0: (0, 0), 5: (2000, 1000)}
+    assert get_canvas_offsets({"subscribe": {"data": {}}}) is None
+
+    redis = MetaHash()
+    assert load_offsets(redis) == BOARD_OFFSETS
+    save_offsets(redis, offsets)
+    assert load_offsets(redis) == offsets
+
+    assert offsets_from_config([]) == {}
@@ -0,0 +1,59 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from placedump.palette import PALETTE_2022, TRANSPARENT, Palette, colors_from_config
+
+
+def test_round_trip():
+    palette = Palette()
+    pixels = np.zeros((2, 2, 4), dtype=np.uint8)
+    pixels[0, 0] = (255, 69, 0, 255)  # #FF4500
+    pixels[0, 1] = (254, 254, 254, 255)  # off palette, nearest #FFFFFF
+
+    indexed = palette.to_indexed(pixels)
+    assert indexed[0, 0] == PALETTE_2022.index("#FF4500")
+    assert indexed[0, 1] == PALETTE_2022.index("#FFFFFF")
+    assert indexed[1, 1] == TRANSPARENT
+
+    rgba = palette.to_rgba(indexed)
+    assert tuple(rgba[0, 0]) == (255, 69, 0, 255)
+    assert tuple(rgba[0, 1]) == (255, 255, 255, 255)
+    assert rgba[1, 1, 3] == 0
+
+
+def test_config_palette():
+    colors = colors_from_config(
+        [
+            {"hex": "#FFFFFF", "index": 31, "__typename": "Color"},
+            {"hex": "#FF4500", "index": 2, "__typename": "Color"},
+        ]
+    )
+    assert len(colors) == 32
+    assert colors[2] == "#FF4500" and colors[0] is None
+
+    palette = Palette(colors)
+    pixels = np.array([[[255, 255, 255, 255], [255, 70, 0, 255]]], dtype=np.uint8)
+    assert palette.to_indexed(pixels).tolist() == [[31, 2]]
+    assert palette.rgba[0, 3] == 0
+
+
+def test_index_image():
+    palette = Palette()
+    rgba = Image.new("RGBA", (4, 3), (0, 0, 0, 0))
+    rgba.putpixel((1, 2), (0, 0, 0, 255))
+    rgba.putpixel((3, 0), (255, 69, 0, 255))
+
+    expected = np.full((3, 4), TRANSPARENT, dtype=np.uint8)
+    expected[2, 1] = PALETTE_2022.index("#000000")
+    expected[0, 3] = PALETTE_2022.index("#FF4500")
+
+    # Paletted PNGs go through their own palette, keep the tRNS chunk.
+    for img in (rgba, rgba.convert("P"), rgba.quantize(colors=3)):
+        f_data = BytesIO()
+        img.save(f_data, format="PNG")
+        assert (palette.decode(f_data.getvalue()) == expected).all()
+
+    image = palette.to_image(expected)
+    assert image.convert("RGBA").getpixel((3, 0)) == (255, 69, 0, 255)
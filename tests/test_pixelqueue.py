@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from placedump import pixelqueue
+from placedump.common import get_redis
+
+
+def clear(redis):
+    redis.delete(
+        pixelqueue.LEGACY_KEY,
+        pixelqueue.ROWS_KEY,
+        pixelqueue.COUNT_KEY,
+        *[pixelqueue.BITMAP_PREFIX + str(board) for board in range(4)],
+    )
+
+
+def test_push_pop():
+    redis = get_redis()
+    clear(redis)
+
+    pixels = [(0, 0, 0), (0, 999, 0), (1, 5, 7), (3, 2047, 2047)]
+    assert pixelqueue.push(redis, pixels + [(0, 0, 0)]) == 4
+    assert pixelqueue.push(redis, [(1, 5, 7)]) == 0
+
+    popped = pixelqueue.pop(redis, 3)
+    assert len(popped) == 3
+    popped += pixelqueue.pop(redis, 10)
+
+    assert sorted(popped) == sorted(pixels)
+    assert pixelqueue.pop(redis, 10) == []
+    assert redis.get(pixelqueue.COUNT_KEY) == "0"
+    assert redis.scard(pixelqueue.ROWS_KEY) == 0
+    clear(redis)
+
+
+def test_encode_range():
+    with pytest.raises(ValueError):
+        pixelqueue.encode(0, pixelqueue.STRIDE, 0)
+
+    assert pixelqueue.decode([1, 2, 3, 0, 4, 5]) == [(1, 2, 3), (0, 4, 5)]
+    assert pixelqueue.decode_legacy(json.dumps({"x": "4", "y": "5", "board": "0"})) == (
+        0,
+        4,
+        5,
+    )
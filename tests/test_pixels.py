@@ -1,4 +1,11 @@
-from placedump.tasks.pixels import get_pixel
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from placedump.common import get_redis
+from placedump.tasks.pixels import BUSY_RETRY, download_url, get_alpha_mask, get_pixel
+from placedump.urls import CLAIMED, claim_key, claim_url
 
 
 def test_pixel_get():
@@ -8,3 +15,40 @@ def test_pixel_get():
     assert pixel["y"] == 420
 
     print(pixel)
+
+
+def test_alpha_mask_modes():
+    rgba = Image.new("RGBA", (4, 3), (0, 0, 0, 0))
+    rgba.putpixel((1, 2), (0, 0, 0, 255))
+    rgba.putpixel((3, 0), (255, 69, 0, 255))
+
+    expected = np.zeros((3, 4), dtype=bool)
+    expected[2, 1] = expected[0, 3] = True
+
+    assert (get_alpha_mask(rgba) == expected).all()
+    assert (get_alpha_mask(rgba.convert("P")) == expected).all()
+
+    # Round trip through PNG so paletted frames keep their tRNS chunk.
+    for img in (rgba, rgba.quantize(colors=3)):
+        f_data = BytesIO()
+        img.save(f_data, format="PNG")
+        f_data.seek(0)
+        assert (get_alpha_mask(Image.open(f_data)) == expected).all()
+
+
+def test_download_busy_retries(monkeypatch):
+    url = "https://hot-potato.reddit.com/media/canvas-images/test-busy.png"
+    redis = get_redis()
+    redis.delete(claim_key(url))
+    assert claim_url(redis, url, "holder") == CLAIMED
+
+    queued = []
+    monkeypatch.setattr(
+        download_url,
+        "apply_async",
+        lambda args, **kwargs: queued.append((args, kwargs)),
+    )
+    download_url(2, url)
+    redis.delete(claim_key(url))
+
+    assert queued == [((2, url), {"countdown": BUSY_RETRY})]
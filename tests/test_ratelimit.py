@@ -0,0 +1,29 @@
+import pytest
+from b2sdk.exception import TooManyRequests
+
+from placedump.ratelimit import AdaptiveLimiter
+
+
+def test_limit_grows_and_cuts():
+    limiter = AdaptiveLimiter("test", initial=4)
+    limiter.redis.delete(limiter.state_key, limiter.inflight_key)
+
+    for _ in range(4):
+        with limiter.slot():
+            pass
+    grown = float(limiter.redis.hget(limiter.state_key, "limit"))
+    assert 4 < grown <= 5
+
+    with pytest.raises(TooManyRequests):
+        with limiter.slot():
+            raise TooManyRequests()
+    assert float(limiter.redis.hget(limiter.state_key, "limit")) == grown / 2
+
+    # Other errors only give the slot back.
+    with pytest.raises(ValueError):
+        with limiter.slot():
+            raise ValueError()
+    assert float(limiter.redis.hget(limiter.state_key, "limit")) == grown / 2
+    assert limiter.redis.zcard(limiter.inflight_key) == 0
+
+    limiter.redis.delete(limiter.state_key, limiter.inflight_key)
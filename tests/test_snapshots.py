@@ -0,0 +1,117 @@
+import json
+
+from placedump.archive import SegmentWriter
+from placedump.canvas import DIFF_FRAME, FULL_FRAME, BoardState, Frame, Reconstructor
+from placedump.palette import PALETTE_2022, TRANSPARENT, Palette
+from placedump.snapshots import SnapshotStore, board_at
+
+
+def test_snapshot_store(tmp_path, png):
+    store = SnapshotStore(str(tmp_path), interval_ms=1000, every_diffs=3)
+    red, blue = PALETTE_2022.index("#FF4500"), PALETTE_2022.index("#2450A4")
+
+    state = BoardState(4, 4)
+    for timestamp in (1000.0, 1500.0, 2500.0, 2600.0, 2700.0):
+        state.timestamp = timestamp
+        store.observe(Frame(0, DIFF_FRAME, "", timestamp, None), state)
+
+    # First frame, then by time, then by diff count.
+    assert store.timestamps(0) == [1000, 2500]
+    assert SnapshotStore(str(tmp_path)).timestamps(0) == [1000, 2500]
+    assert store.nearest(0, 999) is None
+    assert store.nearest(0, 2499) == 1000
+
+    state.pixels[1, 1] = red
+    state.timestamp = 5000.0
+    store.write(0, state)
+
+    # Unpacked from the compressed copy when the .npy is gone.
+    (tmp_path / "0" / "5000.npy").unlink()
+    seed = store.load_state(0, 6000)
+    assert seed.timestamp == 5000.0
+    assert seed.pixels[1, 1] == red
+
+    # A seeded board only applies the diffs after the keyframe.
+    blue_rgba = (36, 80, 164, 255)
+    images = {"old": png({(0, 0): blue_rgba}), "new": png({(2, 2): blue_rgba})}
+    frames = [
+        Frame(0, FULL_FRAME, "full", 1000.0, None),
+        Frame(0, DIFF_FRAME, "old", 4000.0, 3000.0),
+        Frame(0, DIFF_FRAME, "new", 6000.0, 5000.0),
+    ]
+    reconstructor = Reconstructor(
+        fetch=images.__getitem__, workers=1, palette=Palette()
+    )
+    reconstructor.seed(0, seed)
+    board = reconstructor.reconstruct(frames, at=6000)[0]
+    reconstructor.close()
+
+    assert board.timestamp == 6000.0
+    assert board.pixels[1, 1] == red
+    assert board.pixels[2, 2] == blue
+    assert board.pixels[0, 0] == TRANSPARENT
+
+
+def test_board_at_text_mode(tmp_path, png):
+    # Text mode messages from before the canvas_id stream field.
+    def message(board, data):
+        result = {"subscribe": {"data": data}, "canvas_id": board}
+        return json.dumps(result).encode()
+
+    messages = []
+    for board in (0, 1):
+        messages += [
+            (
+                b"%d-%d" % (1000, board),
+                {
+                    b"message": message(
+                        board,
+                        {
+                            "__typename": FULL_FRAME,
+                            "name": f"full{board}",
+                            "timestamp": 1000,
+                        },
+                    ),
+                    b"type": b"text",
+                },
+            ),
+            (
+                b"%d-%d" % (2000, board),
+                {
+                    b"message": message(
+                        board,
+                        {
+                            "__typename": DIFF_FRAME,
+                            "name": f"diff{board}",
+                            "currentTimestamp": 2000,
+                            "previousTimestamp": 1000,
+                        },
+                    ),
+                    b"type": b"text",
+                },
+            ),
+        ]
+
+    writer = SegmentWriter(lambda last_id: None, directory=str(tmp_path / "archive"))
+    writer.start()
+    writer.write(messages)
+    writer.close()
+
+    orange = (255, 69, 0, 255)
+    images = {
+        "full0": png({(0, 0): orange}),
+        "diff0": png({(1, 1): orange}),
+    }
+    reconstructor = Reconstructor(
+        fetch=images.__getitem__, workers=1, palette=Palette()
+    )
+    store = SnapshotStore(str(tmp_path / "snapshots"))
+
+    board = board_at(
+        0, 2000, store, 5000, reconstructor, directory=str(tmp_path / "archive")
+    )
+    reconstructor.close()
+
+    # Board 1's frames are filtered out, fetching them would fail.
+    assert board.timestamp == 2000.0
+    assert board.pixels[1, 1] == PALETTE_2022.index("#FF4500")
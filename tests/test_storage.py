@@ -0,0 +1,31 @@
+from placedump.storage import PackWriter, blob_name, content_hash, legacy_name
+
+
+def test_blob_name():
+    digest = content_hash(b"frame")
+
+    assert len(digest) == 64
+    assert content_hash(b"frame") == digest
+    assert content_hash(b"other") != digest
+    assert blob_name(digest) == f"blobs/{digest}.png"
+
+
+def test_legacy_name():
+    url = "https://hot-potato.reddit.com/media/canvas-images/1-f-a.png"
+
+    assert legacy_name(url) == "hot-potato.reddit.com/media/canvas-images/1-f-a.png"
+
+
+def test_pack_duplicate_not_new(monkeypatch):
+    writer = PackWriter(max_age=3600)
+    monkeypatch.setattr(
+        writer, "_upload", lambda data, entries: [(d, True) for d in entries]
+    )
+
+    data = b"pack writer duplicate frame"
+    first = writer.store(data)
+    second = writer.store(data)
+    writer.flush()
+
+    assert first.result() == (content_hash(data), True)
+    assert second.result() == (content_hash(data), False)
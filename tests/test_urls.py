@@ -0,0 +1,94 @@
+import time
+
+from placedump import urls
+from placedump.common import get_redis
+from placedump.urls import (
+    BUSY,
+    CLAIMED,
+    DONE,
+    UrlWriter,
+    abandon_urls,
+    claim_key,
+    claim_url,
+    complete_urls,
+    release_url,
+)
+
+URL = "https://hot-potato.reddit.com/media/canvas-images/test-claim.png"
+
+
+def test_claim_lifecycle():
+    redis = get_redis()
+    redis.delete(claim_key(URL))
+
+    assert claim_url(redis, URL, "a") == CLAIMED
+    assert claim_url(redis, URL, "b") == BUSY
+
+    # Only the holder can release.
+    release_url(redis, URL, "b")
+    assert claim_url(redis, URL, "b") == BUSY
+    release_url(redis, URL, "a")
+    assert claim_url(redis, URL, "b") == CLAIMED
+
+    complete_urls(redis, [URL])
+    assert claim_url(redis, URL, "c") == DONE
+    redis.delete(claim_key(URL))
+
+
+def test_claim_lease_expires():
+    redis = get_redis()
+    redis.delete(claim_key(URL))
+
+    assert claim_url(redis, URL, "a", lease_ms=1) == CLAIMED
+    time.sleep(0.01)
+
+    assert claim_url(redis, URL, "b") == CLAIMED
+    redis.delete(claim_key(URL))
+
+
+def test_abandon_urls():
+    redis = get_redis()
+    redis.delete(claim_key(URL))
+
+    assert claim_url(redis, URL, "a") == CLAIMED
+    abandon_urls(redis, [URL])
+    assert claim_url(redis, URL, "b") == CLAIMED
+
+    complete_urls(redis, [URL])
+    abandon_urls(redis, [URL])
+    assert claim_url(redis, URL, "c") == DONE
+    redis.delete(claim_key(URL))
+
+
+def test_writer_requeues_failed_rows(monkeypatch):
+    writer = UrlWriter(batch_size=2, interval=3600, max_buffer=3)
+    written = []
+    abandoned = []
+
+    def write(rows):
+        # Cassandra takes "ok" rows and fails everything else.
+        written.extend(row[0] for row in rows if row[0].startswith("ok"))
+        return [row for row in rows if not row[0].startswith("ok")]
+
+    monkeypatch.setattr(writer, "_write", write)
+    monkeypatch.setattr(
+        urls, "abandon_urls", lambda redis, dropped: abandoned.extend(dropped)
+    )
+
+    writer.add("ok-1", 1, "a")
+    writer.add("bad-1", 1, "b")
+    assert written == ["ok-1"]
+    assert [row[0] for row in writer.rows] == ["bad-1"]
+    assert writer.retry_at > time.monotonic()
+
+    # Backing off, a full buffer doesn't flush again yet.
+    writer.add("bad-2", 1, "c")
+    writer.add("bad-3", 1, "d")
+    assert [row[0] for row in writer.rows] == ["bad-1", "bad-2", "bad-3"]
+
+    # Past max_buffer the oldest rows are dropped and their claims freed.
+    writer.add("bad-4", 1, "e")
+    writer.flush()
+    assert [row[0] for row in writer.rows] == ["bad-2", "bad-3", "bad-4"]
+    assert abandoned == ["bad-1"]
+    assert writer.failures == 2